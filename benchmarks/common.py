@@ -0,0 +1,55 @@
+# Společné funkce benchmarků: statistiky vzorků a ukládání výsledků do JSON
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+def percentile(sorted_samples, quantile):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(quantile * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+# Souhrn vzorků v sekundách, výstup v milisekundách
+def summarize(samples):
+    ordered = sorted(samples)
+    to_ms = lambda value: round(value * 1000, 4) if value is not None else None
+    return {
+        'count': len(ordered),
+        'mean_ms': to_ms(statistics.fmean(ordered)) if ordered else None,
+        'p50_ms': to_ms(percentile(ordered, 0.5)),
+        'p95_ms': to_ms(percentile(ordered, 0.95)),
+        'p99_ms': to_ms(percentile(ordered, 0.99)),
+        'max_ms': to_ms(ordered[-1]) if ordered else None,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Uložení výsledků spolu s metadaty, aby šlo porovnávat jednotlivé běhy
+def write_results(path, benchmark, parameters, results):
+    document = {
+        'benchmark': benchmark,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'parameters': parameters,
+        'results': results,
+    }
+    print(json.dumps(document, indent=2, ensure_ascii=False))
+    if path:
+        with open(path, 'w') as output_file:
+            json.dump(document, output_file, indent=2, ensure_ascii=False)
+    return document
@@ -0,0 +1,49 @@
+# Porovnání dvou JSON výsledků benchmarků (micro, load, startup), vypíše změnu
+# každé číselné hodnoty v procentech.
+#
+# Použití:
+#     python -m benchmarks.compare baseline.json current.json [--threshold 10]
+import argparse
+import json
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}{key}.")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix.rstrip('.'), value
+
+def load_results(path):
+    with open(path) as result_file:
+        document = json.load(result_file)
+    return dict(flatten(document.get('results', document)))
+
+# Propustnost je lepší vyšší, ostatní metriky (časy, chybovost) nižší
+def is_regression(name, change, threshold):
+    if 'rps' in name:
+        return change < -threshold
+    return change > threshold
+
+def main():
+    parser = argparse.ArgumentParser(description='Porovnání výsledků dvou běhů benchmarku')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0, help='hranice regrese v procentech')
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline)
+    current = load_results(args.current)
+    regressions = 0
+    for name in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[name], current[name]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ''
+        if is_regression(name, change, args.threshold):
+            flag = '  << regrese'
+            regressions += 1
+        print(f"{name:60} {before:>12.4g} {after:>12.4g} {change:>+8.1f} %{flag}")
+    print(f"\nRegresí nad {args.threshold} %: {regressions}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,161 @@
+# Lokální náhrady za OpenAI a Google služby s nastavitelnou latencí a chybovostí,
+# aby šel výkon aplikace měřit bez síťových volání a opakovatelně.
+#
+#     from benchmarks import fakes
+#     fakes.install(chatbot, fakes.default_profiles(llm=0.8, tts=0.3))
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from google.api_core import exceptions as google_exceptions
+
+# Latence a chybovost jedné služby (latence v sekundách, rozptyl jako směrodatná odchylka)
+class LatencyProfile:
+    def __init__(self, latency=0.1, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def sample(self):
+        return max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+
+    def maybe_fail(self, name):
+        if self.error_rate and random.random() < self.error_rate:
+            raise google_exceptions.ServiceUnavailable(f"Simulovaný výpadek služby {name}")
+
+def default_profiles(llm=0.8, stt=0.5, tts=0.3, translate=0.1, jitter=0.2, error_rate=0.0):
+    return {
+        'openai': LatencyProfile(llm, llm * jitter, error_rate),
+        'speech': LatencyProfile(stt, stt * jitter, error_rate),
+        'tts': LatencyProfile(tts, tts * jitter, error_rate),
+        'translate': LatencyProfile(translate, translate * jitter, error_rate),
+    }
+
+fake_answer = (
+    "Práce je nejlepším lékem na všechny neduhy. Nejlepší reklamou je spokojený zákazník. "
+    "Když chceš vybudovat velký podnik, vybuduj nejdřív sebe."
+)
+
+def completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def completion_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+def answer_tokens():
+    return [word + ' ' for word in fake_answer.split(' ')]
+
+class FakeCompletions:
+    def __init__(self, profile):
+        self.profile = profile
+
+    def create(self, stream=False, timeout=None, **kwargs):
+        self.profile.maybe_fail('openai')
+        latency = self.profile.sample()
+        if not stream:
+            time.sleep(latency)
+            return completion(fake_answer)
+        return self._stream(latency)
+
+    # První token po 30 % celkové doby, zbytek rovnoměrně
+    def _stream(self, latency):
+        tokens = answer_tokens()
+        time.sleep(latency * 0.3)
+        for token in tokens:
+            yield completion_chunk(token)
+            time.sleep(latency * 0.7 / len(tokens))
+
+class FakeOpenAI:
+    def __init__(self, profile):
+        self.api_key = 'fake'
+        self.chat = SimpleNamespace(completions=FakeCompletions(profile))
+
+class FakeSpeechClient:
+    def __init__(self, profile, transcript="Jak byste dnes vedl obuvnickou továrnu?"):
+        self.profile = profile
+        self.transcript = transcript
+
+    def _response(self, is_final=True):
+        alternative = SimpleNamespace(transcript=self.transcript)
+        return SimpleNamespace(results=[SimpleNamespace(alternatives=[alternative], is_final=is_final)])
+
+    def recognize(self, config=None, audio=None, retry=None, timeout=None):
+        self.profile.maybe_fail('speech')
+        time.sleep(self.profile.sample())
+        return self._response()
+
+    def streaming_recognize(self, config=None, requests=None, retry=None, timeout=None):
+        self.profile.maybe_fail('speech')
+        for _ in requests:
+            yield self._response(is_final=False)
+        time.sleep(self.profile.sample())
+        yield self._response()
+
+# Zvuk s hlavičkou podle formátu (OGG začíná značkou kontejneru), jinak jen výplň
+def fake_audio(text, audio_config, bytes_per_char):
+    header = b'OggS' if getattr(audio_config.audio_encoding, 'name', None) == 'OGG_OPUS' else b''
+    return header + b'\xff' * (len(text) * bytes_per_char)
+
+class FakeTTSClient:
+    def __init__(self, profile, bytes_per_char=200):
+        self.profile = profile
+        self.bytes_per_char = bytes_per_char
+
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, retry=None, timeout=None):
+        self.profile.maybe_fail('tts')
+        time.sleep(self.profile.sample())
+        return SimpleNamespace(audio_content=fake_audio(input.text, audio_config, self.bytes_per_char))
+
+class FakeTranslateClient:
+    def __init__(self, profile):
+        self.profile = profile
+
+    def translate(self, values, target_language=None, **kwargs):
+        self.profile.maybe_fail('translate')
+        time.sleep(self.profile.sample())
+        if isinstance(values, str):
+            return {'translatedText': f"[{target_language}] {values}"}
+        return [{'translatedText': f"[{target_language}] {value}"} for value in values]
+
+# Asynchronní varianty pro režim BATA_ASYNC_MODE
+class FakeAsyncCompletions:
+    def __init__(self, profile):
+        self.profile = profile
+
+    async def create(self, timeout=None, **kwargs):
+        self.profile.maybe_fail('openai')
+        await asyncio.sleep(self.profile.sample())
+        return completion(fake_answer)
+
+class FakeAsyncOpenAI:
+    def __init__(self, profile):
+        self.api_key = 'fake'
+        self.chat = SimpleNamespace(completions=FakeAsyncCompletions(profile))
+
+class FakeAsyncSpeechClient(FakeSpeechClient):
+    async def recognize(self, config=None, audio=None, retry=None, timeout=None):
+        self.profile.maybe_fail('speech')
+        await asyncio.sleep(self.profile.sample())
+        return self._response()
+
+class FakeAsyncTTSClient(FakeTTSClient):
+    async def synthesize_speech(self, input=None, voice=None, audio_config=None, retry=None, timeout=None):
+        self.profile.maybe_fail('tts')
+        await asyncio.sleep(self.profile.sample())
+        return SimpleNamespace(audio_content=fake_audio(input.text, audio_config, self.bytes_per_char))
+
+# Nahrazení klientů v modulu chatbot falešnými službami
+def install(chatbot, profiles=None):
+    profiles = profiles or default_profiles()
+    chatbot.clients.update({
+        'openai': FakeOpenAI(profiles['openai']),
+        'speech': FakeSpeechClient(profiles['speech']),
+        'tts': FakeTTSClient(profiles['tts']),
+        'translate': FakeTranslateClient(profiles['translate']),
+    })
+    chatbot.async_clients.update({
+        'openai': FakeAsyncOpenAI(profiles['openai']),
+        'speech': FakeAsyncSpeechClient(profiles['speech']),
+        'tts': FakeAsyncTTSClient(profiles['tts']),
+    })
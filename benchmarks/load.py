@@ -0,0 +1,139 @@
+# Zátěžový test /text_chat a /voice_chat proti lokálním náhradám externích služeb.
+# Aplikace běží ve vlastním vlákně (werkzeug, threaded), souběžní virtuální uživatelé
+# posílají požadavky po dobu --duration sekund. Výsledkem je propustnost,
+# chybovost a percentily p50/p95/p99 pro každý endpoint.
+#
+# Použití (z kořene repozitáře):
+#     python -m benchmarks.load --concurrency 32 --duration 30 --output load.json
+#     python -m benchmarks.load --llm-latency 1.5 --error-rate 0.05 --voice-ratio 0.5
+#     python -m benchmarks.load --url http://127.0.0.1:5000   # už běžící server
+import argparse
+import random
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks import fakes
+from benchmarks.common import summarize, write_results
+
+import chatbot
+
+questions = [
+    "Jak byste dnes vedl obuvnickou továrnu?",
+    "Proč jste postavil Zlín?",
+    "Jak se staráte o zaměstnance?",
+    "Co je pro vás nejdůležitější?",
+    "Jak vznikla firma Baťa?",
+    "Jakou radu byste dal mladým podnikatelům?",
+    "Proč prodáváte boty za 99?",
+    "Co si myslíte o vzdělání?",
+]
+
+# Nahrávka se nevyhodnocuje (rozpoznání obstarává náhrada), záleží jen na velikosti
+fake_recording = b'\x1a\x45\xdf\xa3' + b'\x00' * 48000
+
+def start_server(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+def text_request(http, base_url, rng, unique):
+    question = rng.choice(questions)
+    if unique:
+        question = f"{question} ({rng.randrange(10 ** 9)})"
+    return http.post(f"{base_url}/text_chat", json={'text': question, 'language': 'cs'}, timeout=60)
+
+def voice_request(http, base_url, rng, unique):
+    files = {'file': ('recording.webm', fake_recording, 'audio/webm')}
+    return http.post(f"{base_url}/voice_chat", files=files, data={'language': 'cs'}, timeout=60)
+
+# Jeden virtuální uživatel: vlastní sezení (cookie), požadavky jeden po druhém
+def virtual_user(base_url, deadline, voice_ratio, unique, recorder, seed):
+    rng = random.Random(seed)
+    http = requests.Session()
+    while time.monotonic() < deadline:
+        endpoint, send = ('voice_chat', voice_request) if rng.random() < voice_ratio else ('text_chat', text_request)
+        start = time.perf_counter()
+        try:
+            ok = send(http, base_url, rng, unique).status_code == 200
+        except requests.RequestException:
+            ok = False
+        recorder.record(endpoint, time.perf_counter() - start, ok)
+
+def run(base_url, concurrency, duration, voice_ratio, unique, seed):
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    users = [
+        threading.Thread(target=virtual_user, args=(base_url, deadline, voice_ratio, unique, recorder, seed + index))
+        for index in range(concurrency)
+    ]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for endpoint, samples in recorder.samples.items():
+        errors = recorder.errors.get(endpoint, 0)
+        results[endpoint] = {
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'error_rate': round(errors / len(samples), 4),
+            'latency': summarize(samples),
+        }
+    total = sum(len(samples) for samples in recorder.samples.values())
+    results['total'] = {'requests': total, 'throughput_rps': round(total / elapsed, 2), 'elapsed_s': round(elapsed, 2)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Zátěžový test chatovacích endpointů')
+    parser.add_argument('--url', help='adresa běžícího serveru; bez ní se spustí lokální server s náhradami služeb')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--voice-ratio', type=float, default=0.2, help='podíl požadavků na /voice_chat')
+    parser.add_argument('--unique', action='store_true', help='unikátní otázky (obchází mezipaměti odpovědí)')
+    parser.add_argument('--llm-latency', type=float, default=0.8)
+    parser.add_argument('--stt-latency', type=float, default=0.5)
+    parser.add_argument('--tts-latency', type=float, default=0.3)
+    parser.add_argument('--translate-latency', type=float, default=0.1)
+    parser.add_argument('--jitter', type=float, default=0.2, help='směrodatná odchylka latence jako podíl průměru')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='cesta k JSON souboru s výsledky')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        fakes.install(chatbot, fakes.default_profiles(
+            llm=args.llm_latency, stt=args.stt_latency, tts=args.tts_latency,
+            translate=args.translate_latency, jitter=args.jitter, error_rate=args.error_rate,
+        ))
+        server, base_url = start_server(chatbot.app)
+
+    try:
+        results = run(base_url, args.concurrency, args.duration, args.voice_ratio, args.unique, args.seed)
+        if server:
+            results['upstream_breakers'] = {service.name: service.breaker.state for service in chatbot.upstream_services}
+    finally:
+        if server:
+            server.shutdown()
+    write_results(args.output, 'load', vars(args), results)
+
+if __name__ == '__main__':
+    main()
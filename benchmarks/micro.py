@@ -0,0 +1,74 @@
+# Mikrobenchmarky funkcí, kterými prochází každý dotaz: get_relevant_context,
+# update_context a update_analytics, pro různé velikosti kontextové paměti
+# a typy úložiště. Externí služby se nevolají.
+#
+# Použití (z kořene repozitáře):
+#     python -m benchmarks.micro --sizes 1000 10000 100000 --output micro.json
+#     python -m benchmarks.micro --stores ring ivf --iterations 2000
+import argparse
+import random
+import time
+
+from benchmarks.common import summarize, write_results
+
+import chatbot
+
+vocabulary = (
+    "baťa zlín obuv boty práce zákazník továrna podnik prodejna cena kvalita zaměstnanec "
+    "mzda výroba export vzdělání škola město architektura letadlo cesta indie brazílie "
+    "filozofie úspěch služba veřejnosti bydlení spolupráce samospráva dílna reklama"
+).split()
+
+def synthetic_question(rng):
+    return ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(4, 12))) + '?'
+
+def measure(func, arguments):
+    samples = []
+    for args in arguments:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+# Jedno sezení naplněné `size` dvojicemi otázka/odpověď
+def prepare_session(kind, size, rng):
+    chatbot.session_memory = chatbot.SessionMemoryManager(capacity=size, kind=kind)
+    session_id = f"bench-{kind}-{size}"
+    memory = chatbot.session_memory.get(session_id)
+    for _ in range(size):
+        memory.add(synthetic_question(rng), "Práce je nejlepším lékem.")
+    return session_id
+
+def run(sizes, stores, iterations, seed):
+    rng = random.Random(seed)
+    queries = [synthetic_question(rng) for _ in range(iterations)]
+    results = {}
+    for kind in stores:
+        for size in sizes:
+            start = time.perf_counter()
+            session_id = prepare_session(kind, size, rng)
+            fill_seconds = time.perf_counter() - start
+            chatbot.get_relevant_context(queries[0], session_id)  # zahřátí (trénink IVF apod.)
+            results[f"{kind}/{size}"] = {
+                'fill_s': round(fill_seconds, 3),
+                'get_relevant_context': measure(chatbot.get_relevant_context, [(query, session_id) for query in queries]),
+                'update_context': measure(chatbot.update_context, [(query, "Odpověď.", session_id) for query in queries]),
+            }
+    results['update_analytics'] = measure(chatbot.update_analytics, [(query, "Odpověď.", 0.5) for query in queries])
+    results['embed_text'] = measure(chatbot.embed_text, [(query,) for query in queries])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Mikrobenchmarky kontextové paměti a analytiky')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--stores', nargs='+', default=list(chatbot.context_store_types), choices=list(chatbot.context_store_types))
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='cesta k JSON souboru s výsledky')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.stores, args.iterations, args.seed)
+    write_results(args.output, 'micro', vars(args), results)
+
+if __name__ == '__main__':
+    main()
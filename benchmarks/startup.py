@@ -0,0 +1,71 @@
+# Měření studeného startu: doba importu chatbot.py a doba do vyřízení prvního požadavku.
+# Každé měření běží v novém interpretu, výsledkem je medián z několika běhů.
+#
+# Použití (z kořene repozitáře):
+#     python -m benchmarks.startup --runs 5 --output startup.json
+#     python -m benchmarks.startup --clients   # i vytvoření klientů (vyžaduje přihlašovací údaje)
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Skript pro podproces, vypíše naměřené časy jako JSON
+child_script = """
+import json, sys, time
+start = time.perf_counter()
+import chatbot
+timings = {'import': time.perf_counter() - start}
+
+test_client = chatbot.app.test_client()
+step = time.perf_counter()
+test_client.get('/')
+timings['first_request_home'] = time.perf_counter() - step
+timings['time_to_first_request'] = time.perf_counter() - start
+
+step = time.perf_counter()
+test_client.get('/analytics')
+timings['first_request_analytics'] = time.perf_counter() - step
+
+step = time.perf_counter()
+chatbot.embed_text('Kdo jste?')
+timings['first_embedding'] = time.perf_counter() - step
+
+if '--clients' in sys.argv:
+    for name in chatbot.client_factories:
+        step = time.perf_counter()
+        chatbot.get_client(name)
+        timings['client_' + name] = time.perf_counter() - step
+
+print(json.dumps(timings))
+"""
+
+def run_once(with_clients):
+    command = [sys.executable, '-c', child_script] + (['--clients'] if with_clients else [])
+    result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Měření studeného startu aplikace')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--clients', action='store_true', help='změřit i vytvoření klientů externích služeb')
+    parser.add_argument('--output', help='cesta k JSON souboru s výsledky')
+    args = parser.parse_args()
+
+    runs = [run_once(args.clients) for _ in range(args.runs)]
+    results = {
+        'runs': args.runs,
+        'median_seconds': {key: statistics.median(run[key] for run in runs) for key in runs[0]},
+        'max_seconds': {key: max(run[key] for run in runs) for key in runs[0]},
+    }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+if __name__ == '__main__':
+    main()
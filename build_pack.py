@@ -0,0 +1,40 @@
+# Sestavení balíčku předem vygenerovaných odpovědí a zvuku pro nejčastější otázky.
+# Pracovní procesy ho načtou při startu (BATA_ANSWER_PACK=cesta), takže první
+# návštěvníci po nasazení nečekají na model ani na syntézu řeči.
+#
+# Použití:
+#     python build_pack.py --questions otazky.txt --languages cs en de --output packs/answers.pack
+#     python build_pack.py --archive /var/lib/bata/archive --top 500 --formats mp3 ogg --output packs/answers.pack
+import argparse
+import os
+
+import chatbot
+
+def main():
+    parser = argparse.ArgumentParser(description='Sestavení balíčku odpovědí a zvuku')
+    parser.add_argument('--questions', help='soubor s otázkami v češtině, jedna na řádek')
+    parser.add_argument('--archive', help='adresář archivu konverzací, použijí se nejčastější otázky')
+    parser.add_argument('--top', type=int, default=200, help='počet otázek z archivu')
+    parser.add_argument('--languages', nargs='+', default=['cs'], help='jazyky pro otázky ze souboru')
+    parser.add_argument('--voices', nargs='+', default=['default'])
+    parser.add_argument('--speech-rate', type=float, default=1.0)
+    parser.add_argument('--formats', nargs='+', default=['mp3'], choices=sorted(chatbot.AUDIO_FORMATS), help='formáty zvuku (mp3, ogg)')
+    parser.add_argument('--version', help='verze balíčku (výchozí je čas sestavení)')
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    questions = []
+    if args.questions:
+        with open(args.questions, encoding='utf-8') as questions_file:
+            questions += [line.strip() for line in questions_file if line.strip()]
+    if args.archive:
+        questions += chatbot.ConversationArchive(args.archive, readonly=True).top_questions(args.top)
+    if not questions:
+        parser.error('zadejte --questions nebo --archive')
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    version, count = chatbot.build_answer_pack(args.output, questions, args.languages, args.voices, args.speech_rate, args.version, args.formats)
+    print(f"Balíček {args.output} verze {version}: {count} odpovědí")
+
+if __name__ == '__main__':
+    main()
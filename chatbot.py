@@ -1,104 +1,1985 @@
 import io
 import os
-import base64
-from flask import Flask, request, jsonify, send_file, render_template_string, session
-from google.cloud import speech_v1
-from google.cloud import texttospeech
-from google.cloud import translate_v2 as translate
-from werkzeug.utils import secure_filename
+import gzip
+import re
+import json
+import hashlib
+import hmac
+import math
+import itertools
+import mmap
+import unicodedata
+import shutil
+import sqlite3
+from flask import Flask, Response, g, request, jsonify, send_file, session, stream_with_context
 import traceback
+import asyncio
+import threading
+import time
+import uuid
+import queue
+import random
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
 from flask_cors import CORS
-from openai import OpenAI
+try:
+    import fcntl  # Zámky souborů archivu (na Windows není, archiv pak sdílí jen jeden proces)
+except ImportError:
+    fcntl = None
+try:
+    import brotli  # Volitelné, menší varianta statických souborů pro prohlížeče, které ji přijímají
+except ImportError:
+    brotli = None
+try:
+    from flask_sock import Sock  # Volitelné, pro streamované rozpoznávání řeči přes WebSocket
+except ImportError:
+    Sock = None
 from datetime import datetime
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
 
-# Nastavení OpenAI API klíče
-client = OpenAI(api_key=os.environ.get(""))
+# Nastavení volání externích služeb (časové limity v sekundách)
+UPSTREAM_TIMEOUTS = {
+    'openai': float(os.environ.get('BATA_OPENAI_TIMEOUT', 20)),
+    'speech': float(os.environ.get('BATA_SPEECH_TIMEOUT', 15)),
+    'tts': float(os.environ.get('BATA_TTS_TIMEOUT', 10)),
+    'translate': float(os.environ.get('BATA_TRANSLATE_TIMEOUT', 5)),
+}
+UPSTREAM_RETRIES = int(os.environ.get('BATA_UPSTREAM_RETRIES', 2))
+UPSTREAM_BACKOFF = 0.2  # Základ exponenciálního čekání mezi pokusy
+UPSTREAM_POOL_SIZE = int(os.environ.get('BATA_UPSTREAM_POOL_SIZE', 32))
+LLM_HEDGE_DELAY = float(os.environ.get('BATA_LLM_HEDGE_DELAY', 0))  # 0 = bez záložního dotazu
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('BATA_CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get('BATA_CIRCUIT_RESET_TIMEOUT', 30))
+
+# Nastavení řízení přístupu: kolik souběžných volání smí běžet na každou službu,
+# kolik jich smí čekat a jak dlouho nejvýše
+UPSTREAM_CONCURRENCY = {
+    'openai': int(os.environ.get('BATA_OPENAI_CONCURRENCY', 16)),
+    'speech': int(os.environ.get('BATA_SPEECH_CONCURRENCY', 8)),
+    'tts': int(os.environ.get('BATA_TTS_CONCURRENCY', 16)),
+    'translate': int(os.environ.get('BATA_TRANSLATE_CONCURRENCY', 32)),
+}
+ADMISSION_QUEUE_SIZE = int(os.environ.get('BATA_ADMISSION_QUEUE_SIZE', 64))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('BATA_ADMISSION_QUEUE_TIMEOUT', 5))  # v sekundách
+ADMISSION_DEFAULT_PRIORITY = 1
+
+# Chyby, které značí přetíženou nebo nedostupnou službu a má smysl je opakovat
+# (třídy se načítají až při první chybě, aby import modulu zůstal rychlý)
+retryable_error_types = None
+
+def is_retryable(error):
+    global retryable_error_types
+    if retryable_error_types is None:
+        import requests
+        from google.api_core import exceptions as google_exceptions
+        from openai import APIConnectionError, RateLimitError, InternalServerError
+        retryable_error_types = (
+            APIConnectionError, RateLimitError, InternalServerError,
+            google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded,
+            google_exceptions.TooManyRequests, google_exceptions.InternalServerError,
+            requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+        )
+    return isinstance(error, retryable_error_types)
+
+class CircuitOpenError(Exception):
+    pass
+
+# Jistič: po sérii selhání službu na chvíli odpojí, pak pustí jeden zkušební dotaz
+class CircuitBreaker:
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    # Zkušební volání skončilo bez výsledku (zrušený požadavek), další volání může zkusit znovu
+    def release_probe(self):
+        with self.lock:
+            self.probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if self.probing else 'open'
+
+class OverloadedError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Priorita a sezení aktuálního požadavku (nastavuje before_request)
+current_admission = contextvars.ContextVar('current_admission', default=None)
+
+# Řízení přístupu k jedné službě: nejvýše `limit` souběžných volání, ostatní čekají
+# v omezené frontě. Uvolněné místo dostane čekatel s nejnižším číslem priority,
+# v rámci priority se sezení střídají dokola (jedno sezení nezablokuje ostatní).
+# Pokud odhad čekání přesáhne termín, odmítne se hned.
+class AdmissionController:
+    def __init__(self, name, limit, queue_size=ADMISSION_QUEUE_SIZE):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self.queues = {}  # priorita -> OrderedDict(sezení -> deque čekatelů)
+        self.service_time = 1.0  # Klouzavý průměr doby volání v sekundách
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _estimate_wait(self, priority):
+        ahead = sum(len(waiters) for level, sessions in self.queues.items() if level <= priority for waiters in sessions.values())
+        return (ahead + 1) * self.service_time / self.limit
+
+    # Doba, po které má smysl to zkusit znovu, pokud by požadavek nestihl termín; jinak None
+    def rejection(self, priority, deadline):
+        with self.lock:
+            if self.active < self.limit and not self.waiting:
+                return None
+            wait_time = self._estimate_wait(priority)
+            if self.waiting >= self.queue_size or time.monotonic() + wait_time > deadline:
+                self.rejected += 1
+                return wait_time
+            return None
+
+    def acquire(self, priority, session_id, deadline):
+        with self.lock:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return
+            wait_time = self._estimate_wait(priority)
+            if self.waiting >= self.queue_size or time.monotonic() + wait_time > deadline:
+                self.rejected += 1
+                raise OverloadedError(f"Služba {self.name} je přetížená", wait_time)
+            waiter = threading.Event()
+            self.queues.setdefault(priority, OrderedDict()).setdefault(session_id, deque()).append(waiter)
+            self.waiting += 1
+        if waiter.wait(max(deadline - time.monotonic(), 0)):
+            return
+        with self.lock:
+            if waiter.is_set():  # Místo bylo předáno současně s vypršením
+                return
+            sessions = self.queues[priority]
+            sessions[session_id].remove(waiter)
+            if not sessions[session_id]:
+                del sessions[session_id]
+            self.waiting -= 1
+            self.rejected += 1
+            raise OverloadedError(f"Služba {self.name} je přetížená", self._estimate_wait(priority))
+
+    # Uvolněné místo přejde rovnou na dalšího čekatele, sezení se zařadí na konec.
+    # Bez doby volání (místo nebylo použito) se průměr neupravuje.
+    def release(self, service_time=None):
+        with self.lock:
+            if service_time is not None:
+                self.service_time = 0.8 * self.service_time + 0.2 * service_time
+            for priority in sorted(self.queues):
+                sessions = self.queues[priority]
+                if not sessions:
+                    continue
+                session_id, waiters = sessions.popitem(last=False)
+                waiter = waiters.popleft()
+                if waiters:
+                    sessions[session_id] = waiters
+                self.waiting -= 1
+                waiter.set()
+                return
+            self.active -= 1
+
+    def stats(self):
+        with self.lock:
+            return {'limit': self.limit, 'active': self.active, 'waiting': self.waiting, 'rejected': self.rejected,
+                    'service_time': round(self.service_time, 3)}
+
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix='bata-upstream')
+
+# Obal volání jedné externí služby: časový limit na celé volání včetně opakování,
+# opakování s náhodným rozptylem (full jitter) a jistič
+class UpstreamService:
+    def __init__(self, name, timeout, retries=UPSTREAM_RETRIES, pass_timeout=True):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.pass_timeout = pass_timeout  # Zda klient přijímá parametr timeout
+        self.breaker = CircuitBreaker()
+        self.admission = AdmissionController(name, UPSTREAM_CONCURRENCY[name])
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Služba {self.name} je dočasně nedostupná")
+
+    # Priorita podle požadavku, mimo požadavek (předehřátí, balíčky) výchozí. Termín
+    # platí pro čekání ve frontě každého volání zvlášť, ne pro celý požadavek:
+    # pozdější kroky (TTS po odpovědi modelu) nesmí spadnout jen kvůli době,
+    # kterou požadavek strávil u předchozích služeb.
+    def _admission_args(self):
+        priority, session_id = current_admission.get() or (ADMISSION_DEFAULT_PRIORITY, None)
+        return priority, session_id, time.monotonic() + ADMISSION_QUEUE_TIMEOUT
+
+    # Jistič se kontroluje až s přiděleným místem, takže odmítnutí z fronty (429)
+    # nezabere zkušební volání. Pokud volání skončí bez výsledku (zrušení),
+    # zkušební stav se uvolní, jinak by jistič zůstal otevřený navždy.
+    @contextmanager
+    def _breaker_scope(self):
+        self._check_breaker()
+        try:
+            yield
+        except Exception:
+            raise
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+
+    # Místo pro jedno volání služby (včetně opakování)
+    @contextmanager
+    def slot(self):
+        self.admission.acquire(*self._admission_args())
+        start = time.perf_counter()
+        try:
+            with self._breaker_scope():
+                yield
+        finally:
+            self.admission.release(time.perf_counter() - start)
+
+    def _retry_delay(self, attempt, deadline, error):
+        delay = random.uniform(0, UPSTREAM_BACKOFF * 2 ** attempt)
+        if attempt >= self.retries or time.monotonic() + delay >= deadline:
+            self.breaker.record_failure()
+            raise error
+        return delay
+
+    def _call_kwargs(self, kwargs, deadline):
+        if self.pass_timeout:
+            kwargs = dict(kwargs, timeout=max(deadline - time.monotonic(), 0.1))
+        return kwargs
+
+    def call(self, func, *args, **kwargs):
+        with self.slot():
+            return self._call(func, *args, **kwargs)
+
+    def _call(self, func, *args, **kwargs):
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        while True:
+            try:
+                result = func(*args, **self._call_kwargs(kwargs, deadline))
+            except Exception as e:
+                if not is_retryable(e):
+                    self._record_error(e)
+                    raise
+                time.sleep(self._retry_delay(attempt, deadline, e))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    # Čekání na místo neblokuje smyčku událostí, běží ve vlákně
+    async def call_async(self, func, *args, **kwargs):
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.admission.acquire, *self._admission_args()))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # Vlákno místo může získat i po zrušení, pak se hned uvolní
+            acquiring.add_done_callback(lambda task: task.cancelled() or task.exception() or self.admission.release())
+            raise
+        start = time.perf_counter()
+        try:
+            with self._breaker_scope():
+                return await self._call_async(func, *args, **kwargs)
+        finally:
+            self.admission.release(time.perf_counter() - start)
+
+    async def _call_async(self, func, *args, **kwargs):
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        while True:
+            try:
+                result = await func(*args, **self._call_kwargs(kwargs, deadline))
+            except Exception as e:
+                if not is_retryable(e):
+                    self._record_error(e)
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, deadline, e))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    # Záložní (hedged) dotaz: pokud první pokus neodpoví do hedge_delay,
+    # spustí se druhý souběžně a použije se první úspěšná odpověď
+    def call_hedged(self, func, *args, hedge_delay=LLM_HEDGE_DELAY, **kwargs):
+        if hedge_delay <= 0:
+            return self.call(func, *args, **kwargs)
+        first = upstream_executor.submit(contextvars.copy_context().run, self.call, func, *args, **kwargs)
+        done, _ = wait([first], timeout=hedge_delay)
+        if done:
+            return first.result()
+        pending = {first, upstream_executor.submit(contextvars.copy_context().run, self.call, func, *args, **kwargs)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+        return first.result()
+
+    # Výsledek volání pro jistič: chyba požadavku znamená, že služba odpověděla
+    def _record_error(self, error):
+        if is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    # Streamovaná odpověď: navázání se opakuje jako u call(), místo ve frontě
+    # i jistič ale platí po celou dobu čtení, dokud volající stream nedočte nebo nezavře.
+    # Navázání zaznamená do jističe už _call(), při čtení se přidá jen výpadek spojení.
+    def stream(self, func, *args, **kwargs):
+        with self.slot():
+            chunks = self._call(func, *args, **kwargs)
+            try:
+                yield from chunks
+            except Exception as e:
+                if is_retryable(e):
+                    self.breaker.record_failure()
+                raise
+
+    # Pro streamovaná volání, která nejde opakovat: jen kontrola a aktualizace jističe
+    @contextmanager
+    def guard(self):
+        with self.slot():
+            try:
+                yield
+            except Exception as e:
+                self._record_error(e)
+                raise
+            self.breaker.record_success()
+
+openai_service = UpstreamService('openai', UPSTREAM_TIMEOUTS['openai'])
+speech_service = UpstreamService('speech', UPSTREAM_TIMEOUTS['speech'])
+tts_service = UpstreamService('tts', UPSTREAM_TIMEOUTS['tts'])
+translate_service = UpstreamService('translate', UPSTREAM_TIMEOUTS['translate'], pass_timeout=False)
+upstream_services = [openai_service, speech_service, tts_service, translate_service]
 
 # Nastavení Google Cloud API s přesnou cestou k souboru s přihlašovacími údaji
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = r""
 
-# Inicializace Google služeb
-speech_client = speech_v1.SpeechClient()
-tts_client = texttospeech.TextToSpeechClient()
-translate_client = translate.Client()
-speech_config = speech_v1.RecognitionConfig(
-    encoding=speech_v1.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-    sample_rate_hertz=48000,
-    language_code="cs-CZ",
-)
+# Nastavení OpenAI API klíče (opakování řeší UpstreamService, ne knihovna)
+def create_openai_client():
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+    return OpenAI(
+        api_key=os.environ.get(""),
+        max_retries=0,
+        timeout=UPSTREAM_TIMEOUTS['openai'],
+        http_client=DefaultHttpxClient(limits=httpx.Limits(max_connections=UPSTREAM_POOL_SIZE, max_keepalive_connections=UPSTREAM_POOL_SIZE))
+    )
+
+# Klient pro REST API překladače se sdílenou HTTP session s větším poolem spojení
+# a pevným časovým limitem
+def create_translate_client():
+    import google.auth
+    import requests
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import translate_v2 as translate
+
+    class TimeoutAuthorizedSession(AuthorizedSession):
+        def request(self, method, url, *args, **kwargs):
+            kwargs['timeout'] = UPSTREAM_TIMEOUTS['translate']
+            return super().request(method, url, *args, **kwargs)
+
+    credentials, _ = google.auth.default(scopes=translate.Client.SCOPE)
+    session = TimeoutAuthorizedSession(credentials)
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=UPSTREAM_POOL_SIZE, pool_maxsize=UPSTREAM_POOL_SIZE))
+    return translate.Client(credentials=credentials, _http=session)
+
+# gRPC klienti Google multiplexují požadavky přes jeden HTTP/2 kanál
+def create_speech_client():
+    from google.cloud import speech_v1
+    return speech_v1.SpeechClient()
+
+def create_tts_client():
+    from google.cloud import texttospeech
+    return texttospeech.TextToSpeechClient()
+
+client_factories = {
+    'openai': create_openai_client,
+    'speech': create_speech_client,
+    'tts': create_tts_client,
+    'translate': create_translate_client,
+}
+clients = {}
+clients_lock = threading.Lock()
+
+# Klienti externích služeb se vytvářejí líně při prvním použití, import modulu
+# ani start aplikace tak nečekají na načtení knihoven a přihlašovacích údajů
+def get_client(name):
+    service_client = clients.get(name)
+    if service_client is None:
+        with clients_lock:
+            if name not in clients:
+                clients[name] = client_factories[name]()
+            service_client = clients[name]
+    return service_client
+
+# Konfigurace rozpoznávání řeči se sestaví jednou pro každý jazyk a vzorkovací
+# frekvenci nahrávky a dál se používá opakovaně
+SPEECH_LANGUAGE_CODES = {'cs': 'cs-CZ', 'en': 'en-US', 'de': 'de-DE'}
+SPEECH_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)  # Frekvence, které WEBM_OPUS podporuje
+SPEECH_DEFAULT_SAMPLE_RATE = 48000
+speech_configs = {}
+
+# Funkce pro ověření vzorkovací frekvence zaslané klientem
+def get_speech_sample_rate(value):
+    try:
+        sample_rate = int(value)
+    except (TypeError, ValueError):
+        return SPEECH_DEFAULT_SAMPLE_RATE
+    return sample_rate if sample_rate in SPEECH_SAMPLE_RATES else SPEECH_DEFAULT_SAMPLE_RATE
+
+def get_speech_config(language='cs', sample_rate=SPEECH_DEFAULT_SAMPLE_RATE):
+    key = (SPEECH_LANGUAGE_CODES.get(language, 'cs-CZ'), sample_rate)
+    config = speech_configs.get(key)
+    if config is None:
+        from google.cloud import speech_v1
+        config = speech_v1.RecognitionConfig(
+            encoding=speech_v1.RecognitionConfig.AudioEncoding.WEBM_OPUS,
+            sample_rate_hertz=sample_rate,
+            language_code=key[0],
+        )
+        speech_configs[key] = config
+    return config
+
+# Formáty syntetizované řeči, které si klient může vyžádat. Opus v OGG je při
+# nižší vzorkovací frekvenci několikanásobně menší než MP3, MP3 přehraje každý prohlížeč.
+AUDIO_FORMATS = {
+    'mp3': {'encoding': 'MP3', 'mimetype': 'audio/mpeg', 'sample_rate': None},
+    'ogg': {'encoding': 'OGG_OPUS', 'mimetype': 'audio/ogg', 'sample_rate': int(os.environ.get('BATA_OPUS_SAMPLE_RATE', 24000))},
+}
+DEFAULT_AUDIO_FORMAT = os.environ.get('BATA_AUDIO_FORMAT', 'mp3')
+
+# Funkce pro výběr formátu zvuku podle požadavku klienta
+def get_audio_format(value):
+    return value if value in AUDIO_FORMATS else DEFAULT_AUDIO_FORMAT
+
+# Inicializace hashovacího vektorizéru pro kontextové učení
+# (pevný slovník, není potřeba ho při každém dotazu znovu trénovat).
+# Znaménkové hashování do malého počtu dimenzí funguje jako náhodná projekce,
+# takže vektory lze držet v kompaktních float32 maticích.
+EMBEDDING_DIM = 256
+vectorizer = None
+
+# Vektorizér se vytvoří až při první potřebě, import scikit-learn je pomalý
+def get_vectorizer():
+    global vectorizer
+    if vectorizer is None:
+        from sklearn.feature_extraction.text import HashingVectorizer
+        vectorizer = HashingVectorizer(n_features=EMBEDDING_DIM, ngram_range=(1, 2), alternate_sign=True, norm='l2')
+    return vectorizer
+
+# Nastavení kontextového úložiště
+CONTEXT_STORE_KIND = os.environ.get('BATA_CONTEXT_STORE', 'ring')  # ring, lru nebo ivf
+CONTEXT_MEMORY_SIZE = int(os.environ.get('BATA_CONTEXT_MEMORY_SIZE', 100000))
+CONTEXT_TOP_K = 3
+CONTEXT_SCORE_THRESHOLD = 0.3
+
+# Funkce pro převod textu na normalizovaný vektor
+def embed_text(text):
+    return get_vectorizer().transform([text]).toarray()[0].astype(np.float32)
+
+# Výběr k nejlepších výsledků nad prahem, seřazených sestupně
+def top_k_scores(scores, k, threshold):
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    candidates = candidates[np.argsort(-scores[candidates])]
+    return [int(i) for i in candidates if scores[i] >= threshold]
+
+# Kruhový buffer s pevnou kapacitou, nejstarší záznam se přepíše novým
+class RingBufferContextStore:
+    def __init__(self, capacity=CONTEXT_MEMORY_SIZE, dim=EMBEDDING_DIM):
+        self.capacity = capacity
+        self.vectors = np.zeros((min(capacity, 64), dim), dtype=np.float32)
+        self.entries = []
+        self.position = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Matice roste zdvojnásobením až do kapacity, aby malá paměť nezabírala místo
+    def _ensure_room(self, slot):
+        if slot >= len(self.vectors):
+            grown = np.zeros((min(self.capacity, len(self.vectors) * 2), self.vectors.shape[1]), dtype=np.float32)
+            grown[:len(self.vectors)] = self.vectors
+            self.vectors = grown
+
+    def _next_slot(self):
+        slot = self.position
+        self.position = (self.position + 1) % self.capacity
+        return slot
+
+    def _store(self, slot, entry, vector):
+        self._ensure_room(slot)
+        self.vectors[slot] = vector
+        if slot < len(self.entries):
+            self.entries[slot] = entry
+        else:
+            self.entries.append(entry)
+
+    def _on_hit(self, slot):
+        pass
+
+    def _candidate_slots(self, vector):
+        return None  # Prohledává se celé úložiště
+
+    def add(self, user_message, bot_response, vector=None):
+        if vector is None:
+            vector = embed_text(user_message)
+        slot = self._next_slot()
+        self._store(slot, (user_message, bot_response), vector)
+        return slot
+
+    def search_slots(self, query, k=CONTEXT_TOP_K, threshold=CONTEXT_SCORE_THRESHOLD):
+        if not self.entries:
+            return []
+        vector = embed_text(query) if isinstance(query, str) else query
+        slots = self._candidate_slots(vector)
+        if slots is None:
+            scores = self.vectors[:len(self.entries)] @ vector
+            best = top_k_scores(scores, k, threshold)
+        else:
+            scores = self.vectors[slots] @ vector
+            best = [int(slots[i]) for i in top_k_scores(scores, k, threshold)]
+        for slot in best:
+            self._on_hit(slot)
+        return best
+
+    def search(self, query, k=CONTEXT_TOP_K, threshold=CONTEXT_SCORE_THRESHOLD):
+        return [self.entries[slot] for slot in self.search_slots(query, k, threshold)]
+
+    # Zneplatnění záznamu: nulový vektor už nikdy nepřekročí práh podobnosti
+    def discard(self, slot):
+        self.vectors[slot] = 0
+        self.entries[slot] = None
+
+# Úložiště s vyřazováním nejdéle nepoužitého záznamu (LRU)
+class LRUContextStore(RingBufferContextStore):
+    def __init__(self, capacity=CONTEXT_MEMORY_SIZE, dim=EMBEDDING_DIM):
+        super().__init__(capacity, dim)
+        self.usage = OrderedDict()  # Sloty od nejdéle nepoužitého po naposledy použitý
+
+    def _next_slot(self):
+        if len(self.entries) < self.capacity:
+            slot = len(self.entries)
+        else:
+            slot, _ = self.usage.popitem(last=False)
+        self.usage[slot] = None
+        return slot
+
+    def _on_hit(self, slot):
+        self.usage.move_to_end(slot)
+
+# Přibližné vyhledávání nejbližších sousedů pomocí invertovaného indexu (IVF).
+# Vektory se rozdělí do shluků podle centroidů a dotaz prochází jen nprobe nejbližších shluků.
+# Počet shluků a velikost trénovacího vzorku se řídí kapacitou (zhruba odmocnina,
+# trénuje se po zaplnění poloviny), aby se natrénovalo i malé úložiště paměti sezení.
+class IVFContextStore(RingBufferContextStore):
+    def __init__(self, capacity=CONTEXT_MEMORY_SIZE, dim=EMBEDDING_DIM, n_lists=None, n_probe=8, train_size=None):
+        super().__init__(capacity, dim)
+        self.train_size = min(train_size or min(max(capacity // 2, 1), 4096), capacity)
+        self.n_lists = min(n_lists or min(math.isqrt(capacity), 128), self.train_size)
+        self.n_probe = min(n_probe, self.n_lists)
+        self.centroids = None
+        self.assignments = np.full(capacity, -1, dtype=np.int32)
+        self.lists = [set() for _ in range(self.n_lists)]
+
+    # Sférický k-means nad vzorkem uložených vektorů
+    def train(self, iterations=10):
+        size = len(self.entries)
+        rng = np.random.default_rng(0)
+        sample = self.vectors[rng.choice(size, min(size, self.train_size), replace=False)]
+        centroids = sample[rng.choice(len(sample), self.n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = (sample @ centroids.T).argmax(axis=1)
+            for i in range(self.n_lists):
+                members = sample[labels == i]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[i] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self.centroids = centroids
+        self.lists = [set() for _ in range(self.n_lists)]
+        labels = (self.vectors[:size] @ centroids.T).argmax(axis=1).astype(np.int32)
+        self.assignments[:size] = labels
+        for slot, label in enumerate(labels):
+            self.lists[label].add(slot)
+
+    def _store(self, slot, entry, vector):
+        super()._store(slot, entry, vector)
+        if self.centroids is None:
+            if len(self.entries) >= self.train_size:
+                self.train()
+            return
+        previous = self.assignments[slot]
+        if previous >= 0:
+            self.lists[previous].discard(slot)
+        label = int((self.centroids @ vector).argmax())
+        self.assignments[slot] = label
+        self.lists[label].add(slot)
+
+    def _candidate_slots(self, vector):
+        if self.centroids is None:
+            return None
+        probes = top_k_scores(self.centroids @ vector, self.n_probe, -np.inf)
+        return np.fromiter((slot for i in probes for slot in self.lists[i]), dtype=np.int64)
+
+context_store_types = {
+    'ring': RingBufferContextStore,
+    'lru': LRUContextStore,
+    'ivf': IVFContextStore,
+}
+
+# Funkce pro vytvoření kontextového úložiště podle konfigurace
+def create_context_store(kind=CONTEXT_STORE_KIND, capacity=CONTEXT_MEMORY_SIZE):
+    if kind not in context_store_types:
+        raise ValueError(f"Neznámý typ kontextového úložiště: {kind}")
+    return context_store_types[kind](capacity)
+
+# Obecná LRU mezipaměť s limitem počtu položek, velikosti v bajtech a volitelnou dobou platnosti
+class LRUCache:
+    def __init__(self, max_items=None, max_bytes=None, ttl=None, size_of=len):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_of = size_of
+        self.items = OrderedDict()  # klíč -> (hodnota, velikost, čas vypršení)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[2] is not None and item[2] < time.monotonic():
+                self._remove(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        size = self.size_of(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.items:
+                self._remove(key)
+            self.items[key] = (value, size, expires)
+            self.total_bytes += size
+            while (self.max_items is not None and len(self.items) > self.max_items) or \
+                    (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self.items)))
+
+    def _remove(self, key):
+        _, size, _ = self.items.pop(key)
+        self.total_bytes -= size
+
+    # Zneplatnění jedné položky, nebo celé mezipaměti
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.items.clear()
+                self.total_bytes = 0
+            elif key in self.items:
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'items': len(self.items),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+# Slučování souběžných stejných volání (single-flight): první volající funkci
+# provede, ostatní se stejným klíčem počkají na jeho výsledek nebo výjimku.
+# Nic se neukládá, po dokončení volání se klíč uvolní.
+class AbandonedCallError(Exception):
+    pass
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}  # klíč -> Future probíhajícího volání
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def _join(self, key):
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self.calls[key] = Future()
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self.lock:
+            self.calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    # Klíč se uvolní i při přerušení prvního volajícího (např. zrušení korutiny),
+    # čekatelé pak dostanou AbandonedCallError a zkusí volání provést sami
+    def _fail(self, key, future, error):
+        self._finish(key, future, error=error if isinstance(error, Exception) else AbandonedCallError(key))
+
+    # Vrací (výsledek, sdílený), kde sdílený znamená výsledek cizího volání
+    def do(self, key, function, *args):
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result(), True
+            except AbandonedCallError:
+                continue
+        try:
+            result = function(*args)
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+    # Varianta pro korutiny; s voláními z vláken sdílí stejné klíče. Zrušení
+    # čekatele nesmí zrušit sdílenou Future ostatních, proto shield.
+    async def do_async(self, key, function, *args):
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except AbandonedCallError:
+                continue
+        try:
+            result = await function(*args)
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+# Nastavení sdíleného stavu mezi pracovními procesy (analytika, kontext sezení, mezipaměti).
+# Bez nastavení zůstává všechno v paměti procesu.
+STATE_BACKEND_URL = os.environ.get('BATA_STATE_BACKEND', '')  # memory, sqlite:///cesta.db nebo redis://host:6379/0
+STATE_SYNC_INTERVAL = float(os.environ.get('BATA_STATE_SYNC_INTERVAL', 1.0))  # v sekundách
+
+# Sdílené úložiště v paměti procesu. Slouží jako lokální náhrada za Redis
+# (stejné rozhraní, ale bez sdílení mezi procesy).
+class MemoryStateBackend:
+    def __init__(self):
+        self.values = {}  # klíč -> (hodnota, čas vypršení)
+        self.lists = {}  # klíč -> (celkový počet zápisů, deque posledních hodnot, čas vypršení)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.values.get(key)
+            if item is None or (item[1] is not None and item[1] < time.time()):
+                return None
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.values[key] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+            self.lists.pop(key, None)
+
+    # Atomická změna hodnoty: function(stará hodnota nebo None) -> nová hodnota
+    def update(self, key, function):
+        with self.lock:
+            item = self.values.get(key)
+            self.values[key] = (function(item[0] if item else None), None)
+
+    # Přidání na konec seznamu omezeného na max_len posledních hodnot, vrací celkový počet zápisů
+    def append(self, key, value, max_len, ttl=None):
+        with self.lock:
+            total, values, _ = self._list(key)
+            values.append(value)
+            while len(values) > max_len:
+                values.popleft()
+            self.lists[key] = (total + 1, values, time.time() + ttl if ttl else None)
+            return total + 1
 
-# Inicializace TF-IDF vektorizéru pro kontextové učení
-vectorizer = TfidfVectorizer()
+    # Hodnoty zapsané po `seen`-tém zápisu (nejvýše tolik, kolik jich seznam drží)
+    def since(self, key, seen):
+        with self.lock:
+            total, values, _ = self._list(key)
+            count = min(max(total - seen, 0), len(values))
+            return total, list(values)[len(values) - count:]
+
+    def _list(self, key):
+        item = self.lists.get(key)
+        if item is None or (item[2] is not None and item[2] < time.time()):
+            return 0, deque(), None
+        return item
+
+# Sdílené úložiště v SQLite v režimu WAL: čtenáři neblokují zapisovatele, takže
+# ho mohou souběžně používat všechny pracovní procesy na jednom stroji
+class SQLiteStateBackend:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()  # Spojení SQLite nelze sdílet mezi vlákny
+        connection = self._connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS lists (key TEXT, seq INTEGER, value BLOB, PRIMARY KEY (key, seq))")
+        connection.execute("CREATE TABLE IF NOT EXISTS list_totals (key TEXT PRIMARY KEY, total INTEGER, expires REAL)")
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def get(self, key):
+        row = self._connection().execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        self._connection().execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, time.time() + ttl if ttl else None))
+
+    def delete(self, key):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM kv WHERE key = ?", (key,))
+            connection.execute("DELETE FROM lists WHERE key = ?", (key,))
+            connection.execute("DELETE FROM list_totals WHERE key = ?", (key,))
+
+    def update(self, key, function):
+        with self._transaction() as connection:
+            row = connection.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+            connection.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, NULL)", (key, function(row[0] if row else None)))
+
+    def append(self, key, value, max_len, ttl=None):
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute("SELECT total, expires FROM list_totals WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                connection.execute("DELETE FROM lists WHERE key = ?", (key,))
+                total = 0
+            else:
+                total = row[0]
+            total += 1
+            connection.execute("INSERT INTO lists VALUES (?, ?, ?)", (key, total, value))
+            connection.execute("DELETE FROM lists WHERE key = ? AND seq <= ?", (key, total - max_len))
+            connection.execute("INSERT OR REPLACE INTO list_totals VALUES (?, ?, ?)", (key, total, now + ttl if ttl else None))
+            if random.random() < 0.01:  # Občasný úklid vypršených seznamů a hodnot
+                connection.execute("DELETE FROM lists WHERE key IN (SELECT key FROM list_totals WHERE expires < ?)", (now,))
+                connection.execute("DELETE FROM list_totals WHERE expires < ?", (now,))
+                connection.execute("DELETE FROM kv WHERE expires < ?", (now,))
+        return total
+
+    def since(self, key, seen):
+        connection = self._connection()
+        row = connection.execute("SELECT total, expires FROM list_totals WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return 0, []
+        rows = connection.execute("SELECT value FROM lists WHERE key = ? AND seq > ? ORDER BY seq", (key, seen)).fetchall()
+        return row[0], [value for value, in rows]
+
+# Sdílené úložiště v Redisu (nebo kompatibilním serveru), i mezi více stroji
+class RedisStateBackend:
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key, key + ':total')
+
+    # Optimistická transakce: při souběžné změně klíče se výpočet zopakuje
+    def update(self, key, function):
+        import redis
+        with self.client.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(key)
+                    value = function(pipeline.get(key))
+                    pipeline.multi()
+                    pipeline.set(key, value)
+                    pipeline.execute()
+                    return
+                except redis.WatchError:
+                    continue
+
+    def append(self, key, value, max_len, ttl=None):
+        pipeline = self.client.pipeline()
+        pipeline.rpush(key, value)
+        pipeline.ltrim(key, -max_len, -1)
+        pipeline.incr(key + ':total')
+        if ttl:
+            pipeline.expire(key, int(ttl))
+            pipeline.expire(key + ':total', int(ttl))
+        return pipeline.execute()[2]
+
+    def since(self, key, seen):
+        pipeline = self.client.pipeline()
+        pipeline.get(key + ':total')
+        pipeline.llen(key)
+        total, length = pipeline.execute()
+        total = int(total or 0)
+        count = min(max(total - seen, 0), length)
+        return total, self.client.lrange(key, -count, -1) if count else []
+
+# Funkce pro vytvoření sdíleného úložiště podle adresy (prázdná adresa = bez sdílení)
+def create_state_backend(url=STATE_BACKEND_URL):
+    if not url:
+        return None
+    if url == 'memory':
+        return MemoryStateBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteStateBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStateBackend(url)
+    raise ValueError(f"Neznámé sdílené úložiště: {url}")
+
+state_backend = create_state_backend()
+
+# Dvouúrovňová mezipaměť: lokální LRU a pod ní sdílené úložiště, hodnoty se
+# do sdíleného úložiště ukládají jako JSON pod hashem klíče
+class SharedCache:
+    def __init__(self, local, backend, prefix, ttl=None):
+        self.local = local
+        self.backend = backend
+        self.prefix = prefix
+        self.ttl = ttl
+        self.shared_hits = 0
+
+    def _shared_key(self, key):
+        payload = json.dumps(key, ensure_ascii=False)
+        return f"{self.prefix}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        data = self.backend.get(self._shared_key(key))
+        if data is None:
+            return None
+        value = json.loads(data)
+        self.shared_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        self.backend.set(self._shared_key(key), json.dumps(value, ensure_ascii=False).encode('utf-8'), self.ttl)
+
+    # Zneplatní se jen lokální úroveň tohoto pracovního procesu; sdílené položky
+    # (a lokální kopie v ostatních procesech) vyprší podle ttl
+    def invalidate(self, key=None):
+        self.local.invalidate(key)
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['shared_hits'] = self.shared_hits
+        return stats
+
+# Funkce pro vytvoření mezipaměti, která je při nastaveném sdíleném úložišti dvouúrovňová
+def create_cache(prefix, ttl=None, **options):
+    local = LRUCache(ttl=ttl, **options)
+    if state_backend is None:
+        return local
+    return SharedCache(local, state_backend, prefix, ttl)
 
 # Inicializace Flask aplikace
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Pro podporu sessions
+app.secret_key = os.environ.get('BATA_SECRET_KEY') or os.urandom(24)  # Pro podporu sessions (u více procesů musí být sdílený)
 CORS(app)
 
-# Globální proměnné pro analytiku a kontextové učení
-analytics_data = {
-    'total_conversations': 0,
-    'total_messages': 0,
-    'popular_topics': {},
-    'average_response_time': 0,
-    'feedback': {'positive': 0, 'negative': 0}
-}
-context_memory = []
+# Nastavení analytiky
+ANALYTICS_SHARDS = 16
+ANALYTICS_SNAPSHOT_INTERVAL = 1.0  # Jak dlouho (v sekundách) se vrací stejný předpočítaný snímek
+ANALYTICS_TOP_TOPICS = 20
+TOPIC_CANDIDATES = 200  # Počet kandidátů na nejčastější témata v jednom shardu
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+LATENCY_SLOT_SECONDS = 10
+LATENCY_SLOTS = 90  # Historie 15 minut
+LATENCY_WINDOWS = {'1m': 60, '5m': 300, '15m': 900}
+LATENCY_MIN = 0.001  # Histogram s logaritmickými koši od 1 ms s relativní přesností 5 %
+LATENCY_GROWTH = 1.05
+LATENCY_BUCKETS = int(math.log(120 / LATENCY_MIN) / math.log(LATENCY_GROWTH)) + 2
+
+def latency_bucket(seconds):
+    if seconds <= LATENCY_MIN:
+        return 0
+    return min(int(math.log(seconds / LATENCY_MIN) / math.log(LATENCY_GROWTH)) + 1, LATENCY_BUCKETS - 1)
+
+# Stabilní (na procesu nezávislé) pozice slova v řádcích Count-Min Sketch
+def sketch_indexes(word):
+    digest = hashlib.blake2b(word.encode('utf-8'), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], 'little')
+    second = int.from_bytes(digest[8:], 'little') | 1
+    return [(first + row * second) % SKETCH_WIDTH for row in range(SKETCH_DEPTH)]
+
+sketch_rows = np.arange(SKETCH_DEPTH)
+
+# Jeden shard analytiky: čítače, Count-Min Sketch témat s omezeným počtem
+# kandidátů a histogramy doby odezvy po časových úsecích. Stejná struktura
+# slouží i pro sloučený stav (všechny jeho části lze sčítat).
+class AnalyticsShard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = {
+            'total_conversations': 0,
+            'response_time_sum': 0.0,
+            'feedback_positive': 0,
+            'feedback_negative': 0
+        }
+        self.sketch = np.zeros((SKETCH_DEPTH, SKETCH_WIDTH), dtype=np.int64)
+        self.candidates = {}
+        self.latency = np.zeros((LATENCY_SLOTS, LATENCY_BUCKETS), dtype=np.int64)
+        self.latency_epochs = np.full(LATENCY_SLOTS, -1, dtype=np.int64)
+
+    def add_topic(self, word):
+        indexes = sketch_indexes(word)
+        self.sketch[sketch_rows, indexes] += 1
+        estimate = int(self.sketch[sketch_rows, indexes].min())
+        if word in self.candidates or len(self.candidates) < TOPIC_CANDIDATES:
+            self.candidates[word] = estimate
+            return
+        weakest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[weakest]:
+            del self.candidates[weakest]
+            self.candidates[word] = estimate
+
+    def add_latency(self, seconds, now):
+        epoch = int(now // LATENCY_SLOT_SECONDS)
+        slot = epoch % LATENCY_SLOTS
+        if self.latency_epochs[slot] != epoch:
+            self.latency[slot] = 0
+            self.latency_epochs[slot] = epoch
+        self.latency[slot, latency_bucket(seconds)] += 1
+
+    def topic_estimate(self, word):
+        return int(self.sketch[sketch_rows, sketch_indexes(word)].min())
+
+    # Přičtení jiného stavu; časové úseky se sčítají jen u stejné epochy, novější přepíše starší
+    def merge(self, other, max_candidates=None):
+        for key, value in other.counters.items():
+            self.counters[key] += value
+        self.sketch += other.sketch
+        self.candidates.update(dict.fromkeys(other.candidates, 0))  # Četnost se odhadne až ze sloučeného sketche
+        if max_candidates is not None and len(self.candidates) > max_candidates:
+            estimates = {word: self.topic_estimate(word) for word in self.candidates}
+            self.candidates = dict(sorted(estimates.items(), key=lambda item: -item[1])[:max_candidates])
+        newer = other.latency_epochs > self.latency_epochs
+        same = (other.latency_epochs == self.latency_epochs) & (other.latency_epochs >= 0)
+        self.latency[newer] = other.latency[newer]
+        self.latency[same] += other.latency[same]
+        self.latency_epochs[newer] = other.latency_epochs[newer]
+
+    # Serializace pro sdílené úložiště (npz bez pickle)
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            counters=np.array(list(self.counters.values()), dtype=np.float64),
+            sketch=self.sketch,
+            candidates=np.array(list(self.candidates), dtype=str),
+            latency=self.latency,
+            latency_epochs=self.latency_epochs,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        state = cls()
+        if data:
+            with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+                for key, value in zip(state.counters, arrays['counters']):
+                    state.counters[key] = type(state.counters[key])(value)
+                state.sketch = arrays['sketch']
+                state.latency = arrays['latency']
+                state.latency_epochs = arrays['latency_epochs']
+                state.candidates = dict.fromkeys((str(word) for word in arrays['candidates']), 0)
+        return state
+
+# Analytika rozdělená do shardů podle vlákna (každý s vlastním zámkem, takže
+# se vlákna téměř nepřetahují), při čtení se shardy sloučí do snímku.
+# Se sdíleným úložištěm se přírůstky shardů pravidelně přičítají ke společnému
+# stavu všech pracovních procesů a snímek se počítá z něj.
+class AnalyticsEngine:
+    def __init__(self, shards=ANALYTICS_SHARDS, snapshot_interval=ANALYTICS_SNAPSHOT_INTERVAL, backend=None, sync_interval=STATE_SYNC_INTERVAL):
+        self.shards = [AnalyticsShard() for _ in range(shards)]
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_cache = None
+        self.snapshot_time = 0.0
+        self.snapshot_lock = threading.Lock()
+        self.backend = backend
+        self.sync_interval = sync_interval
+        self.thread_shard = threading.local()
+        self.next_shard = itertools.count()
+        if backend is not None:
+            threading.Thread(target=self._sync_loop, name='bata-analytics-sync', daemon=True).start()
+
+    # Vlákna dostávají oddíly postupně dokola při prvním zápisu. Samotné ID vlákna
+    # je zarovnaná adresa, jeho zbytek po dělení by všechna vlákna poslal do jednoho oddílu.
+    def _shard(self):
+        index = getattr(self.thread_shard, 'index', None)
+        if index is None:
+            index = self.thread_shard.index = next(self.next_shard) % len(self.shards)
+        return self.shards[index]
+
+    def record_turn(self, user_message, response_time):
+        words = [word for word in user_message.lower().split() if len(word) > 3]
+        shard = self._shard()
+        with shard.lock:
+            shard.counters['total_conversations'] += 1
+            shard.counters['response_time_sum'] += response_time
+            for word in words:
+                shard.add_topic(word)
+            shard.add_latency(response_time, time.time())
+
+    def record_feedback(self, feedback_type):
+        if feedback_type not in ('positive', 'negative'):
+            return
+        shard = self._shard()
+        with shard.lock:
+            shard.counters['feedback_' + feedback_type] += 1
+
+    # Předpočítaný snímek, přepočítá se nejvýše jednou za snapshot_interval
+    def snapshot(self):
+        now = time.monotonic()
+        if self.snapshot_cache is not None and now - self.snapshot_time < self.snapshot_interval:
+            return self.snapshot_cache
+        with self.snapshot_lock:
+            if self.snapshot_cache is None or time.monotonic() - self.snapshot_time >= self.snapshot_interval:
+                self.snapshot_cache = self.compute_snapshot()
+                self.snapshot_time = time.monotonic()
+        return self.snapshot_cache
+
+    # Sloučení shardů; s reset=True se shardy zároveň vynulují (odeslané přírůstky)
+    def merge_shards(self, reset=False):
+        state = AnalyticsShard()
+        for shard in self.shards:
+            with shard.lock:
+                state.merge(shard)
+                if reset:
+                    shard.reset()
+        return state
+
+    # Přičtení lokálních přírůstků ke společnému stavu ve sdíleném úložišti
+    def flush(self):
+        delta = self.merge_shards(reset=True)
+        if not any(delta.counters.values()):
+            return
+
+        def apply(data):
+            state = AnalyticsShard.from_bytes(data)
+            state.merge(delta, max_candidates=TOPIC_CANDIDATES)
+            return state.to_bytes()
+
+        self.backend.update('analytics', apply)
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Chyba při synchronizaci analytiky: {str(e)}")
+
+    def compute_snapshot(self):
+        if self.backend is not None:
+            self.flush()
+            state = AnalyticsShard.from_bytes(self.backend.get('analytics'))
+        else:
+            state = self.merge_shards()
+
+        current_epoch = int(time.time() // LATENCY_SLOT_SECONDS)
+        latency = {}
+        for name, seconds in LATENCY_WINDOWS.items():
+            in_window = state.latency_epochs > current_epoch - seconds // LATENCY_SLOT_SECONDS
+            latency[name] = state.latency[in_window].sum(axis=0)
+
+        # Četnost kandidátů se odhadne ze sloučeného sketche (sketche se sčítají)
+        topic_counts = {word: state.topic_estimate(word) for word in state.candidates}
+        popular_topics = dict(sorted(topic_counts.items(), key=lambda item: -item[1])[:ANALYTICS_TOP_TOPICS])
+        
+        counters = state.counters
+        conversations = counters['total_conversations']
+        return {
+            'total_conversations': conversations,
+            'total_messages': conversations * 2,
+            'popular_topics': popular_topics,
+            'average_response_time': counters['response_time_sum'] / conversations if conversations else 0,
+            'response_time_percentiles': {name: latency_percentiles(histogram) for name, histogram in latency.items()},
+            'feedback': {'positive': counters['feedback_positive'], 'negative': counters['feedback_negative']}
+        }
+
+# Percentily z histogramu, hodnotou je horní hranice koše (jako u HDR histogramu)
+def latency_percentiles(histogram):
+    total = int(histogram.sum())
+    percentiles = {'count': total}
+    cumulative = np.cumsum(histogram)
+    for name, quantile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        if total:
+            bucket = int(np.searchsorted(cumulative, quantile * total))
+            percentiles[name] = LATENCY_MIN * LATENCY_GROWTH ** bucket
+        else:
+            percentiles[name] = None
+    return percentiles
+
+analytics = AnalyticsEngine(backend=state_backend)
+
+# Nastavení měření jednotlivých kroků zpracování
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TRACE_LOG = os.environ.get('BATA_TRACE_LOG') == '1'  # Strukturovaný záznam průběhu každého požadavku
+
+# Histogram ve formátu Prometheus (kumulativní koše, součet a počet)
+class MetricHistogram:
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}  # (název metriky, štítky) -> MetricHistogram
+        self.lock = threading.Lock()
+
+    def observe(self, name, labels, seconds, error=False):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = MetricHistogram()
+            histogram.observe(seconds, error)
+
+    # Výpis v textovém formátu Prometheus
+    def render(self):
+        lines = []
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for name in sorted({name for (name, _), _ in items}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in items:
+                    if metric != name:
+                        continue
+                    label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{label_text}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{label_text}}} {cumulative}')
+            for name in sorted({name for (name, _), _ in items}):
+                errors_name = name.replace('_duration_seconds', '_errors_total')
+                lines.append(f"# TYPE {errors_name} counter")
+                for (metric, labels), histogram in items:
+                    if metric == name:
+                        label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                        lines.append(f'{errors_name}{{{label_text}}} {histogram.errors}')
+        return lines
+
+metrics = MetricsRegistry()
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+# Zaznamenání doby trvání kroku do metrik a do záznamu aktuálního požadavku
+def observe_stage(stage, seconds, error=False):
+    metrics.observe('bata_stage_duration_seconds', {'stage': stage}, seconds, error)
+    trace = current_trace.get()
+    if trace is not None:
+        trace['spans'].append({'stage': stage, 'duration_ms': round(seconds * 1000, 2), 'error': error})
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start, error)
+
+# Nastavení paměti jednotlivých sezení
+SESSION_MEMORY_SIZE = int(os.environ.get('BATA_SESSION_MEMORY_SIZE', 500))
+SESSION_IDLE_TIMEOUT = int(os.environ.get('BATA_SESSION_IDLE_TIMEOUT', 1800))  # v sekundách
+SESSION_HISTORY_TURNS = int(os.environ.get('BATA_SESSION_HISTORY_TURNS', 6))  # Poslední výměny nabízené do promptu
+
+# Kontextová paměť jednoho sezení s vlastním zámkem. Se sdíleným úložištěm
+# jsou dvojice otázka/odpověď uložené v seznamu sezení a lokální úložiště
+# slouží jako index, který si před každým použitím dotáhne nové záznamy
+# (i ty zapsané jinými pracovními procesy).
+class SessionMemory:
+    def __init__(self, store, backend=None, key=None):
+        self.store = store
+        self.lock = threading.Lock()
+        self.last_access = time.monotonic()
+        self.backend = backend
+        self.key = key
+        self.synced = 0  # Počet zápisů sdíleného seznamu, které už jsou v lokálním úložišti
+        self.recent = deque(maxlen=SESSION_HISTORY_TURNS)  # Poslední výměny v pořadí, jak proběhly
+
+    def add(self, user_message, bot_response):
+        if self.backend is not None:
+            entry = json.dumps([user_message, bot_response], ensure_ascii=False).encode('utf-8')
+            self.backend.append(self.key, entry, self.store.capacity, SESSION_IDLE_TIMEOUT)
+            with self.lock:
+                self._sync()
+            return
+        vector = embed_text(user_message)  # Vektorizace mimo zámek
+        with self.lock:
+            self.store.add(user_message, bot_response, vector)
+            self.recent.append((user_message, bot_response))
+
+    def search(self, user_message, k, threshold):
+        vector = embed_text(user_message)
+        with self.lock:
+            if self.backend is not None:
+                self._sync()
+            return self.store.search(vector, k, threshold)
+
+    def history(self):
+        with self.lock:
+            if self.backend is not None:
+                self._sync()
+            return list(self.recent)
+
+    def is_empty(self):
+        with self.lock:
+            if self.backend is not None:
+                self._sync()
+            return len(self.store) == 0
+
+    # Dotažení nových záznamů ze sdíleného úložiště; menší počet zápisů znamená smazanou historii
+    def _sync(self):
+        total, entries = self.backend.since(self.key, self.synced)
+        if total < self.synced:
+            self.store = type(self.store)(self.store.capacity)
+            self.recent.clear()
+            total, entries = self.backend.since(self.key, 0)
+        for entry in entries:
+            user_message, bot_response = json.loads(entry)
+            self.store.add(user_message, bot_response)
+            self.recent.append((user_message, bot_response))
+        self.synced = total
+
+# Správce kontextové paměti podle ID sezení. Globální zámek chrání jen slovník
+# sezení, samotné vyhledávání a zápis probíhají pod zámkem konkrétního sezení.
+class SessionMemoryManager:
+    def __init__(self, capacity=SESSION_MEMORY_SIZE, idle_timeout=SESSION_IDLE_TIMEOUT, kind=CONTEXT_STORE_KIND, backend=None):
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.kind = kind
+        self.backend = backend
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.last_sweep = time.monotonic()
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            memory = self.sessions.get(session_id)
+            if memory is None:
+                memory = SessionMemory(create_context_store(self.kind, self.capacity), self.backend, f"context:{session_id}")
+                self.sessions[session_id] = memory
+            memory.last_access = now
+            if now - self.last_sweep > self.idle_timeout / 10:
+                self._expire_idle(now)
+        return memory
+
+    # Odstranění sezení, která byla déle nečinná
+    def _expire_idle(self, now):
+        self.last_sweep = now
+        expired = [sid for sid, memory in self.sessions.items() if now - memory.last_access > self.idle_timeout]
+        for sid in expired:
+            del self.sessions[sid]
+
+    def clear(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+        if self.backend is not None:
+            self.backend.delete(f"context:{session_id}")
+
+    def __len__(self):
+        return len(self.sessions)
+
+session_memory = SessionMemoryManager(backend=state_backend)
+
+# Funkce pro získání ID aktuálního sezení
+def get_session_id():
+    if 'session_id' not in session:
+        session['session_id'] = uuid.uuid4().hex
+    return session['session_id']
+
+# Nastavení trvalého archivu konverzací
+ARCHIVE_DIR = os.environ.get('BATA_ARCHIVE_DIR')  # Bez nastavení se archiv nevede
+ARCHIVE_READONLY = os.environ.get('BATA_ARCHIVE_READONLY') == '1'
+# Doplňování kontextu z archivu vkládá do promptu výměny jiných sezení (jiných
+# návštěvníků), proto je vypnuté. Zapnout jen tam, kde to nevadí (např. jeden kiosek).
+ARCHIVE_CONTEXT = os.environ.get('BATA_ARCHIVE_CONTEXT') == '1'
+ARCHIVE_INITIAL_ROWS = 1024
+
+# Trvalý archiv dvojic otázka/odpověď, do kterého se jen připisuje. Každá
+# generace archivu má tři soubory:
+#   records.jsonl - záznamy (otázka, odpověď, jazyk, čas) po řádcích
+#   vectors.f32   - matice vektorů otázek (float32), mapovaná do paměti
+#   index.u64     - počet záznamů a konce řádků v records.jsonl, mapovaný do paměti
+# Otevření archivu soubory jen namapuje, doba startu tak nezávisí na počtu
+# záznamů. Zápisy serializuje zámek souboru, takže archiv mohou sdílet všechny
+# pracovní procesy (a další procesy jen pro čtení). Kompaktace zapíše novou
+# generaci a přepne na ni soubor CURRENT.
+class ConversationArchive:
+    def __init__(self, directory, dim=EMBEDDING_DIM, readonly=False):
+        self.directory = directory
+        self.dim = dim
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.generation = None
+        self.index = None
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.records = None
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        self._refresh()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(os.path.join(self.directory, 'lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _path(self, generation, name):
+        return os.path.join(self.directory, generation, name)
+
+    def _current_generation(self):
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as current_file:
+                return current_file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _set_current(self, generation):
+        temp_path = os.path.join(self.directory, f"CURRENT.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, 'w') as current_file:
+            current_file.write(generation)
+        os.replace(temp_path, os.path.join(self.directory, 'CURRENT'))
+
+    # Prázdná generace s místem pro `rows` záznamů
+    def _create_generation(self, number, rows=ARCHIVE_INITIAL_ROWS):
+        generation = f"gen-{number:08d}"
+        os.makedirs(os.path.join(self.directory, generation), exist_ok=True)
+        open(self._path(generation, 'records.jsonl'), 'wb').close()
+        with open(self._path(generation, 'vectors.f32'), 'wb') as vectors_file:
+            vectors_file.truncate(rows * self.dim * 4)
+        with open(self._path(generation, 'index.u64'), 'wb') as index_file:
+            index_file.truncate((rows + 1) * 8)
+        return generation
+
+    def _map(self, generation):
+        mode = 'r' if self.readonly else 'r+'
+        rows = os.path.getsize(self._path(generation, 'vectors.f32')) // (self.dim * 4)
+        index = np.memmap(self._path(generation, 'index.u64'), dtype=np.uint64, mode=mode)
+        vectors = np.memmap(self._path(generation, 'vectors.f32'), dtype=np.float32, mode=mode, shape=(rows, self.dim))
+        records = open(self._path(generation, 'records.jsonl'), 'rb' if self.readonly else 'r+b')
+        if self.records is not None:
+            self.records.close()
+        self.index, self.vectors, self.records, self.generation = index, vectors, records, generation
+
+    # Přemapování po kompaktaci nebo po zvětšení souborů jiným procesem
+    def _refresh(self):
+        generation = self._current_generation()
+        if generation is None:
+            if self.readonly:
+                return
+            with self._file_lock():
+                generation = self._current_generation()
+                if generation is None:
+                    generation = self._create_generation(1)
+                    self._set_current(generation)
+        if generation != self.generation:
+            try:
+                self._map(generation)
+            except FileNotFoundError:  # Generaci mezitím nahradila kompaktace
+                self._map(self._current_generation())
+        count = int(self.index[0])
+        if count > len(self.vectors) or count + 1 > len(self.index):
+            self._map(generation)
+
+    def __len__(self):
+        return int(self.index[0]) if self.index is not None else 0
+
+    # Zvětšení souborů zdvojnásobením (jen pod zámkem souboru). Soubory se nikdy
+    # nezmenšují, mohl je už zvětšit jiný proces a jiné procesy je mají namapované.
+    def _ensure_capacity(self, rows):
+        if rows <= len(self.vectors):
+            return
+        file_rows = os.path.getsize(self._path(self.generation, 'vectors.f32')) // (self.dim * 4)
+        if rows > file_rows:
+            new_rows = max(rows, file_rows * 2)
+            with open(self._path(self.generation, 'vectors.f32'), 'r+b') as vectors_file:
+                vectors_file.truncate(new_rows * self.dim * 4)
+            with open(self._path(self.generation, 'index.u64'), 'r+b') as index_file:
+                index_file.truncate((new_rows + 1) * 8)
+        self._map(self.generation)
+
+    def append(self, question, answer, language, vector=None):
+        if vector is None:
+            vector = embed_text(question)
+        record = {'question': question, 'answer': answer, 'language': language, 'timestamp': time.time()}
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self.lock, self._file_lock():
+            self._refresh()
+            count = int(self.index[0])
+            start = int(self.index[count]) if count else 0
+            self._ensure_capacity(count + 1)
+            self.records.seek(start)  # Přepíše i případný neúplný řádek po pádu
+            self.records.write(line)
+            self.records.flush()
+            self.vectors[count] = vector
+            self.index[count + 1] = start + len(line)
+            self.index[0] = count + 1  # Zveřejnění záznamu až po zapsání všech částí
+        return count
+
+    def _read(self, slot):
+        start = int(self.index[slot]) if slot else 0
+        self.records.seek(start)
+        return json.loads(self.records.read(int(self.index[slot + 1]) - start))
+
+    def search(self, query, k=CONTEXT_TOP_K, threshold=CONTEXT_SCORE_THRESHOLD):
+        vector = embed_text(query) if isinstance(query, str) else query
+        with self.lock:
+            self._refresh()
+            count = len(self)
+            vectors = self.vectors
+        if not count:
+            return []
+        best = top_k_scores(vectors[:count] @ vector, k, threshold)  # Násobení matic mimo zámek
+        with self.lock:
+            return [self._read(slot) for slot in best]
+
+    # Kompaktace: ponechá jen nejnovější odpověď na stejnou otázku ve stejném
+    # jazyce a volitelně zahodí záznamy starší než max_age sekund
+    def compact(self, max_age=None):
+        cutoff = time.time() - max_age if max_age else None
+        with self.lock, self._file_lock():
+            self._refresh()
+            count = len(self)
+            latest = {}
+            self.records.seek(0)
+            for slot in range(count):
+                record = json.loads(self.records.readline())
+                if cutoff is None or record['timestamp'] >= cutoff:
+                    latest[(record['language'], record['question'].strip().lower())] = slot
+            keep = sorted(latest.values())
+
+            old_generation = self.generation
+            generation = self._create_generation(int(old_generation.split('-')[1]) + 1, max(len(keep), ARCHIVE_INITIAL_ROWS))
+            vectors = np.memmap(self._path(generation, 'vectors.f32'), dtype=np.float32, mode='r+', shape=(max(len(keep), ARCHIVE_INITIAL_ROWS), self.dim))
+            index = np.memmap(self._path(generation, 'index.u64'), dtype=np.uint64, mode='r+')
+            end = 0
+            with open(self._path(generation, 'records.jsonl'), 'wb') as records_file:
+                for new_slot, slot in enumerate(keep):
+                    start = int(self.index[slot]) if slot else 0
+                    self.records.seek(start)
+                    line = self.records.read(int(self.index[slot + 1]) - start)
+                    records_file.write(line)
+                    end += len(line)
+                    vectors[new_slot] = self.vectors[slot]
+                    index[new_slot + 1] = end
+            index[0] = len(keep)
+            vectors.flush()
+            index.flush()
+            del vectors, index
+
+            self._set_current(generation)
+            self._map(generation)
+            # Procesy, které mají starou generaci namapovanou, ji mohou číst až do přemapování
+            shutil.rmtree(os.path.join(self.directory, old_generation), ignore_errors=True)
+        return {'before': count, 'after': len(keep), 'generation': generation}
+
+    def __iter__(self):
+        with self.lock:
+            self._refresh()
+            self.records.seek(0)
+            lines = [self.records.readline() for _ in range(len(self))]
+        return (json.loads(line) for line in lines)
+
+    # Nejčastější otázky jako dvojice (otázka, jazyk); varianty se sloučí podle tvaru bez diakritiky
+    def top_questions(self, limit):
+        counts = {}
+        originals = {}
+        for record in self:
+            key = (fold_text(record['question']), record['language'])
+            counts[key] = counts.get(key, 0) + 1
+            originals.setdefault(key, record['question'])
+        top = sorted(counts, key=lambda key: -counts[key])[:limit]
+        return [(originals[key], key[1]) for key in top]
+
+    def stats(self):
+        with self.lock:
+            return {'records': len(self), 'generation': self.generation, 'readonly': self.readonly}
+
+archive = ConversationArchive(ARCHIVE_DIR, readonly=ARCHIVE_READONLY) if ARCHIVE_DIR else None
+
+# Funkce pro zápis nové odpovědi do archivu
+def archive_turn(user_message, bot_response, language):
+    if archive is None or archive.readonly:
+        return
+    try:
+        archive.append(user_message, bot_response, language)
+    except Exception as e:
+        print(f"Chyba při zápisu do archivu: {str(e)}")
 
 # Funkce pro aktualizaci analytiky
 def update_analytics(user_message, bot_response, response_time):
-    global analytics_data
-    analytics_data['total_conversations'] += 1
-    analytics_data['total_messages'] += 2
-    analytics_data['average_response_time'] = (analytics_data['average_response_time'] * (analytics_data['total_messages'] - 2) + response_time) / analytics_data['total_messages']
-    
-    words = user_message.lower().split()
-    for word in words:
-        if len(word) > 3:
-            analytics_data['popular_topics'][word] = analytics_data['popular_topics'].get(word, 0) + 1
+    analytics.record_turn(user_message, response_time)
 
 # Funkce pro aktualizaci kontextu
-def update_context(user_message, bot_response):
-    global context_memory
-    context_memory.append((user_message, bot_response))
-    if len(context_memory) > 100:
-        context_memory.pop(0)
-
-# Funkce pro získání relevantního kontextu
-def get_relevant_context(user_message):
-    if not context_memory:
-        return None
-    
-    all_messages = [msg for msg, _ in context_memory] + [user_message]
-    tfidf_matrix = vectorizer.fit_transform(all_messages)
-    cosine_similarities = cosine_similarity(tfidf_matrix[-1], tfidf_matrix[:-1]).flatten()
-    most_similar_idx = cosine_similarities.argmax()
-    
-    return context_memory[most_similar_idx]
+def update_context(user_message, bot_response, session_id):
+    session_memory.get(session_id).add(user_message, bot_response)
+
+# Funkce pro získání posledních výměn sezení (od nejstarší)
+def get_recent_history(session_id):
+    return session_memory.get(session_id).history()
+
+# Funkce pro získání relevantního kontextu (k nejpodobnějších dvojic otázka/odpověď).
+# Chybějící místa doplní archiv odpovědí ze všech sezení, jen pokud je to výslovně
+# zapnuté (BATA_ARCHIVE_CONTEXT=1).
+def get_relevant_context(user_message, session_id, k=CONTEXT_TOP_K, threshold=CONTEXT_SCORE_THRESHOLD):
+    with timed('retrieval'):
+        context = session_memory.get(session_id).search(user_message, k, threshold)
+        if ARCHIVE_CONTEXT and archive is not None and len(context) < k:
+            questions = {question for question, _ in context}
+            for record in archive.search(user_message, k, threshold):
+                if len(context) < k and record['question'] not in questions:
+                    context.append((record['question'], record['answer']))
+        return context
+
+# Nastavení mezipaměti a dávkování překladů
+TRANSLATION_CACHE_SIZE = int(os.environ.get('BATA_TRANSLATION_CACHE_SIZE', 10000))
+TRANSLATION_CACHE_TTL = int(os.environ.get('BATA_TRANSLATION_CACHE_TTL', 24 * 3600))  # v sekundách
+TRANSLATION_BATCH_WINDOW = float(os.environ.get('BATA_TRANSLATION_BATCH_WINDOW_MS', 0)) / 1000  # 0 = bez dávkování
+TRANSLATION_BATCH_SIZE = 100
+
+translation_cache = create_cache('translate', ttl=TRANSLATION_CACHE_TTL, max_items=TRANSLATION_CACHE_SIZE)
+
+# Slučuje souběžné požadavky na překlad z krátkého časového okna do jednoho
+# volání translate se seznamem textů (zvlášť pro každý cílový jazyk)
+class TranslationBatcher:
+    def __init__(self, window, max_batch=TRANSLATION_BATCH_SIZE):
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, name='bata-translate-batcher', daemon=True).start()
+
+    def translate(self, text, target_language):
+        future = Future()
+        self.queue.put((text, target_language, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            groups = {}
+            for text, target_language, future in self._collect():
+                groups.setdefault(target_language, []).append((text, future))
+            for target_language, items in groups.items():
+                texts = list(dict.fromkeys(text for text, _ in items))
+                try:
+                    results = translate_service.call(get_client('translate').translate, texts, target_language=target_language)
+                    translated = {text: result['translatedText'] for text, result in zip(texts, results)}
+                    for text, future in items:
+                        future.set_result(translated[text])
+                except Exception as e:
+                    for _, future in items:
+                        future.set_exception(e)
+
+translation_batcher = TranslationBatcher(TRANSLATION_BATCH_WINDOW) if TRANSLATION_BATCH_WINDOW > 0 else None
 
 # Funkce pro překlad textu
 def translate_text(text, target_language='cs'):
     try:
-        result = translate_client.translate(text, target_language=target_language)
-        return result['translatedText']
+        return translate_text_strict(text, target_language)
     except Exception as e:
         print(f"Chyba při překladu: {str(e)}")
         return text
 
-# Funkce pro zpracování hlasových příkazů
-def process_voice_command(text):
-    text = text.lower()
-    if "smaž historii" in text:
-        session['conversation_history'] = []
-        return "Historie byla smazána."
-    elif "změň téma" in text:
-        return "Téma bylo změněno."
-    elif "ukonči konverzaci" in text:
-        return "Děkuji za konverzaci. Na shledanou!"
-    else:
+# Překlad, který při chybě výjimku propustí (pro balíčky odpovědí, kde nepřeložený
+# text nesmí projít jako překlad)
+def translate_text_strict(text, target_language='cs'):
+    key = (text, target_language)
+    translated = translation_cache.get(key)
+    if translated is not None:
+        return translated
+    start = time.perf_counter()
+    try:
+        if translation_batcher:
+            translated = translation_batcher.translate(text, target_language)
+        else:
+            result = translate_service.call(get_client('translate').translate, text, target_language=target_language)
+            translated = result['translatedText']
+    except Exception:
+        observe_stage('translate', time.perf_counter() - start, error=True)
+        raise
+    translation_cache.set(key, translated)
+    observe_stage('translate', time.perf_counter() - start)
+    return translated
+
+# Převod textu na tvar pro porovnávání: malá písmena bez diakritiky, jen slova oddělená mezerou
+def fold_text(text):
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[\W_]+', ' ', stripped).split())
+
+# Automat Aho-Corasick: všechny vzory najde jedním průchodem textem
+class AhoCorasick:
+    def __init__(self, patterns):
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for pattern, value in patterns:
+            state = 0
+            for char in pattern:
+                if char not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.transitions[state][char] = len(self.transitions) - 1
+                state = self.transitions[state][char]
+            self.outputs[state].append(value)
+        
+        # Zpětné přechody do nejdelší přípony, která je zároveň začátkem některého vzoru
+        pending = deque(self.transitions[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, target in self.transitions[state].items():
+                pending.append(target)
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                if state:
+                    self.fail[target] = self.transitions[fallback].get(char, 0)
+                self.outputs[target] = self.outputs[target] + self.outputs[self.fail[target]]
+
+    def search(self, text):
+        state = 0
+        for char in text:
+            while state and char not in self.transitions[state]:
+                state = self.fail[state]
+            state = self.transitions[state].get(char, 0)
+            yield from self.outputs[state]
+
+# Záměr, který se vyřeší lokálně bez volání externích služeb. Příkazy se hledají
+# kdekoli ve větě (celá slova), časté dotazy (FAQ) musí odpovídat celé větě.
+class Intent:
+    def __init__(self, name, kind, patterns, responses, handler=None):
+        self.name = name
+        self.kind = kind  # 'command' nebo 'faq'
+        self.patterns = patterns  # jazyk -> seznam frází
+        self.responses = responses  # jazyk -> odpověď
+        self.handler = handler
+
+    def response(self, language):
+        return self.responses.get(language, self.responses['cs'])
+
+# Registr záměrů zkompilovaný pro každý jazyk zvlášť. České fráze se zkouší
+# vždy, návštěvník může mluvit nebo psát česky i při jiném nastaveném jazyce.
+class IntentRouter:
+    def __init__(self, intents):
+        self.intents = intents
+        self.hits = dict.fromkeys((intent.name for intent in intents), 0)
+        self.hits_lock = threading.Lock()  # Počítadla zvyšují vlákna požadavků souběžně
+        languages = {language for intent in intents for language in intent.patterns}
+        self.commands = {}
+        self.faqs = {}
+        for language in languages:
+            patterns = []
+            faqs = {}
+            for priority, intent in enumerate(intents):
+                for phrase in intent.patterns.get(language, []):
+                    if intent.kind == 'command':
+                        patterns.append((f" {fold_text(phrase)} ", (priority, intent)))
+                    else:
+                        faqs.setdefault(fold_text(phrase), intent)
+            self.commands[language] = AhoCorasick(patterns)
+            self.faqs[language] = faqs
+
+    def match(self, text, language='cs', kinds=('command', 'faq')):
+        folded = fold_text(text)
+        for lang in dict.fromkeys((language, 'cs')):
+            if lang not in self.commands:
+                continue
+            if 'command' in kinds:
+                found = min(self.commands[lang].search(f" {folded} "), default=None, key=lambda item: item[0])
+                if found is not None:
+                    return found[1]
+            if 'faq' in kinds and folded in self.faqs[lang]:
+                return self.faqs[lang][folded]
+        return None
+
+    def record_hit(self, intent):
+        with self.hits_lock:
+            self.hits[intent.name] += 1
+
+    def stats(self):
+        with self.hits_lock:
+            return {name: count for name, count in self.hits.items() if count}
+
+def clear_session_history():
+    session['conversation_history'] = []
+    session_memory.clear(get_session_id())
+
+intent_router = IntentRouter([
+    Intent('clear_history', 'command',
+           {'cs': ['smaž historii', 'vymaž historii'], 'en': ['clear history', 'delete history'], 'de': ['verlauf löschen']},
+           {'cs': "Historie byla smazána.", 'en': "The history has been cleared.", 'de': "Der Verlauf wurde gelöscht."},
+           handler=clear_session_history),
+    Intent('change_topic', 'command',
+           {'cs': ['změň téma'], 'en': ['change topic', 'change the topic'], 'de': ['thema wechseln']},
+           {'cs': "Téma bylo změněno.", 'en': "The topic has been changed.", 'de': "Das Thema wurde gewechselt."}),
+    Intent('end_conversation', 'command',
+           {'cs': ['ukonči konverzaci'], 'en': ['end conversation', 'end the conversation'], 'de': ['gespräch beenden']},
+           {'cs': "Děkuji za konverzaci. Na shledanou!", 'en': "Thank you for the conversation. Goodbye!", 'de': "Danke für das Gespräch. Auf Wiedersehen!"}),
+    Intent('greeting', 'faq',
+           {'cs': ['ahoj', 'dobrý den', 'zdravím'], 'en': ['hello', 'hi', 'good day'], 'de': ['hallo', 'guten tag']},
+           {'cs': "Dobrý den! Jsem Tomáš Baťa. Na co se mě chcete zeptat?",
+            'en': "Good day! I am Tomáš Baťa. What would you like to ask me?",
+            'de': "Guten Tag! Ich bin Tomáš Baťa. Was möchten Sie mich fragen?"}),
+    Intent('who_are_you', 'faq',
+           {'cs': ['kdo jste', 'kdo jsi', 'kdo jste vy'], 'en': ['who are you'], 'de': ['wer sind sie', 'wer bist du']},
+           {'cs': "Jsem Tomáš Baťa, český podnikatel a zakladatel obuvnické firmy Baťa.",
+            'en': "I am Tomáš Baťa, a Czech entrepreneur and the founder of the Baťa shoe company.",
+            'de': "Ich bin Tomáš Baťa, ein tschechischer Unternehmer und Gründer der Schuhfirma Baťa."}),
+    Intent('birth', 'faq',
+           {'cs': ['kdy jste se narodil', 'kdy ses narodil'], 'en': ['when were you born'], 'de': ['wann wurden sie geboren']},
+           {'cs': "Narodil jsem se v roce 1876 ve Zlíně.",
+            'en': "I was born in 1876 in Zlín.",
+            'de': "Ich wurde 1876 in Zlín geboren."}),
+    Intent('philosophy', 'faq',
+           {'cs': ['jaká je vaše filozofie', 'jaká je vaše filozofie podnikání'], 'en': ['what is your philosophy', 'what is your business philosophy'],
+            'de': ['was ist ihre philosophie', 'was ist ihre unternehmensphilosophie']},
+           {'cs': "Práce je nejlepším lékem na všechny neduhy a nejlepší reklamou je spokojený zákazník. Náš zákazník, náš pán.",
+            'en': "Work is the best cure for all ills, and the best advertisement is a satisfied customer. Our customer, our master.",
+            'de': "Arbeit ist das beste Heilmittel gegen alle Übel, und die beste Werbung ist ein zufriedener Kunde. Unser Kunde, unser Herr."}),
+])
+
+# Funkce pro zpracování hlasových příkazů a častých dotazů bez volání modelu
+def process_voice_command(text, language='cs', kinds=('command', 'faq')):
+    intent = intent_router.match(text, language, kinds)
+    if intent is None:
         return None  # Není hlasový příkaz, zpracujte jako normální vstup
+    intent_router.record_hit(intent)
+    if intent.handler:
+        intent.handler()
+    return intent.response(language)
+
+# Funkce pro zvuk hotové odpovědi (odpovědi záměrů jsou předem vyrenderované do
+# mezipaměti TTS). Odpověď modelu už je zaplacená a zapsaná v historii, takže při
+# chybě syntézy nebo přetížení TTS se pošle bez zvuku místo chyby nebo 429.
+def reply_audio_url(text, language, voice, speech_rate, audio_format=DEFAULT_AUDIO_FORMAT):
+    try:
+        return text_to_speech_url(text, language, voice, speech_rate, audio_format)
+    except Exception as e:
+        print(f"Chyba při syntéze odpovědi: {str(e)}")
+        return None
+
+# Předem vyrenderovaný zvuk všech odpovědí záměrů (výchozí hlas a rychlost, všechny formáty)
+def prerender_intent_audio(voice='default', speech_rate=1.0):
+    for intent in intent_router.intents:
+        for language, response in intent.responses.items():
+            for audio_format in AUDIO_FORMATS:
+                text_to_speech(response, language, voice, speech_rate, audio_format)
 
 # Kontext pro generování odpovědí ve stylu Tomáše Bati
 bata_context = """
@@ -123,48 +2004,354 @@ Některé z mých známých citátů:
 - "Lidem, kteří chtějí stále jen brát, se říká zloději. Lidem, kteří chtějí jen dávat, se říká svatí. Normální lidé jsou ti, kteří chtějí dávat i brát."
 """
 
-def generate_bata_response(user_input, language='cs'):
+# Nastavení sestavení promptu
+CHAT_MODEL = "gpt-3.5-turbo"
+PROMPT_TOKEN_BUDGET = int(os.environ.get('BATA_PROMPT_TOKEN_BUDGET', 1500))  # Vstupní tokeny celého požadavku
+MESSAGE_OVERHEAD_TOKENS = 4  # Režie formátu chatu na jednu zprávu
+token_encoder = None
+
+# Tokenizér modelu z tiktoken; bez něj (nebo bez staženého slovníku) se počet tokenů odhadne
+def get_token_encoder():
+    global token_encoder
+    if token_encoder is None:
+        try:
+            import tiktoken
+            token_encoder = tiktoken.encoding_for_model(CHAT_MODEL)
+        except Exception:
+            token_encoder = False
+    return token_encoder
+
+# Funkce pro spočítání tokenů zprávy. Odhad počítá s jedním tokenem na 3 bajty UTF-8
+# (čeština s diakritikou vychází v BPE hůř než angličtina, odhad je spíš vyšší).
+def count_tokens(text):
+    encoder = get_token_encoder()
+    if encoder:
+        return len(encoder.encode(text)) + MESSAGE_OVERHEAD_TOKENS
+    return math.ceil(len(text.encode('utf-8')) / 3) + MESSAGE_OVERHEAD_TOKENS
+
+# Výběr výměn do rozpočtu tokenů: střídavě nejnovější z historie a nejrelevantnější
+# z vyhledaného kontextu, dokud se vejdou. Vrací (historie v původním pořadí, kontext).
+def pack_turns(history, relevant_context, budget):
+    history_questions = {question for question, _ in history}
+    retrieved = [turn for turn in relevant_context if turn[0] not in history_questions]
+    recent = list(reversed(history))
+    selected_history, selected_context = set(), []
+    for index in range(max(len(recent), len(retrieved))):
+        for turns, is_history in ((recent, True), (retrieved, False)):
+            if index >= len(turns):
+                continue
+            question, answer = turns[index]
+            cost = count_tokens(question) + count_tokens(answer) if is_history else count_tokens(f"Otázka: {question}\nOdpověď: {answer}")
+            if cost > budget:
+                continue
+            budget -= cost
+            if is_history:
+                selected_history.add(len(recent) - 1 - index)
+            else:
+                selected_context.append((question, answer))
+    return [turn for index, turn in enumerate(history) if index in selected_history], selected_context
+
+# Sestavení požadavku na model. Systémová zpráva je vždy stejná (bajt po bajtu),
+# za ní následuje historie sezení, která se mezi dotazy jen prodlužuje, a teprve
+# potom proměnlivý vyhledaný kontext a dotaz. Společný začátek promptu tak může
+# poskytovatel načíst z mezipaměti.
+def build_chat_request(user_input, relevant_context, history=(), budget=PROMPT_TOKEN_BUDGET):
+    budget -= count_tokens(bata_context) + count_tokens(user_input)
+    history, relevant_context = pack_turns(list(history), relevant_context, budget)
+
+    messages = [{"role": "system", "content": bata_context}]
+    for question, answer in history:
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "assistant", "content": answer})
+    if relevant_context:
+        context = "Předchozí relevantní konverzace:"
+        for question, answer in relevant_context:
+            context += f"\nOtázka: {question}\nOdpověď: {answer}"
+        messages.append({"role": "system", "content": context})
+    messages.append({"role": "user", "content": user_input})
+
+    return dict(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=150,
+        n=1,
+        stop=None,
+        temperature=0.7
+    )
+
+# Nastavení sémantické mezipaměti odpovědí
+RESPONSE_CACHE_ENABLED = os.environ.get('BATA_RESPONSE_CACHE', '1') == '1'
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get('BATA_RESPONSE_CACHE_THRESHOLD', 0.92))
+RESPONSE_CACHE_SIZE = int(os.environ.get('BATA_RESPONSE_CACHE_SIZE', 5000))
+RESPONSE_CACHE_INVALIDATIONS = 100  # Kolik posledních zneplatnění drží sdílený seznam
+
+# Mezipaměť odpovědí podle podobnosti otázek, vedená zvlášť pro každý jazyk.
+# Používá stejné vektory a úložiště jako kontextová paměť. Mezipaměť je v každém
+# pracovním procesu vlastní; se sdíleným úložištěm se zneplatnění zapisují do
+# sdíleného seznamu a ostatní procesy je provedou nejpozději do sync_interval.
+class ResponseCache:
+    def __init__(self, threshold=RESPONSE_CACHE_THRESHOLD, capacity=RESPONSE_CACHE_SIZE, enabled=RESPONSE_CACHE_ENABLED,
+                 backend=None, key='response_cache:invalidations', sync_interval=STATE_SYNC_INTERVAL):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.enabled = enabled
+        self.stores = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.backend = backend
+        self.key = key
+        self.sync_interval = sync_interval
+        self.synced = None  # Počet zápisů sdíleného seznamu, které už jsou provedené
+        self.last_sync = float('-inf')
+
+    def get(self, question, language):
+        if not self.enabled:
+            return None
+        vector = embed_text(question)
+        with self.lock:
+            self._sync()
+            store = self.stores.get(language)
+            slots = store.search_slots(vector, 1, self.threshold) if store else []
+            entry = store.entries[slots[0]] if slots else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, question, language, answer):
+        if not self.enabled:
+            return
+        vector = embed_text(question)
+        with self.lock:
+            self._sync()
+            if language not in self.stores:
+                self.stores[language] = create_context_store('lru', self.capacity)
+            self.stores[language].add(question, answer, vector)
+
+    # Zneplatnění konkrétní otázky (a jejích blízkých variant), jazyka, nebo všeho,
+    # se sdíleným úložištěm ve všech pracovních procesech
+    def invalidate(self, language=None, question=None):
+        if self.backend is None:
+            with self.lock:
+                self._invalidate_locked(language, question)
+            return
+        entry = json.dumps([language, question], ensure_ascii=False).encode('utf-8')
+        self.backend.append(self.key, entry, RESPONSE_CACHE_INVALIDATIONS)
+        with self.lock:
+            self._sync(force=True)
+
+    # Provedení zneplatnění ze sdíleného seznamu. Pokud jich mezitím přibylo víc,
+    # než seznam drží (nebo bylo úložiště vyprázdněno), zahodí se celá mezipaměť.
+    def _sync(self, force=False):
+        if self.backend is None or (not force and time.monotonic() - self.last_sync < self.sync_interval):
+            return
+        self.last_sync = time.monotonic()
+        if self.synced is None:  # Starší zneplatnění se týkají mezipaměti, která tu ještě nebyla
+            self.synced, _ = self.backend.since(self.key, 0)
+        total, entries = self.backend.since(self.key, self.synced)
+        if total < self.synced or total - self.synced > len(entries):
+            self.stores.clear()
+        else:
+            for entry in entries:
+                self._invalidate_locked(*json.loads(entry))
+        self.synced = total
+
+    def _invalidate_locked(self, language, question):
+        if question is None:
+            if language is None:
+                self.stores.clear()
+            else:
+                self.stores.pop(language, None)
+            return
+        vector = embed_text(question)
+        languages = [language] if language is not None else list(self.stores)
+        for lang in languages:
+            store = self.stores.get(lang)
+            if store is None:
+                continue
+            for slot in store.search_slots(vector, len(store), self.threshold):
+                store.discard(slot)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'items': sum(entry is not None for store in self.stores.values() for entry in store.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'threshold': self.threshold
+            }
+
+response_cache = ResponseCache(backend=state_backend)
+
+# Funkce pro odpověď z mezipaměti, pokud už byla položena dostatečně podobná otázka.
+# Sezení s vlastní historií se obsluhují vždy modelem, jejich odpověď závisí na předchozích výměnách.
+def get_cached_response(user_input, language, session_id):
+    if not session_memory.get(session_id).is_empty():
+        return None
+    start_time = datetime.now()
+    bot_response = response_cache.get(user_input, language)
+    if bot_response is not None:
+        end_time = datetime.now()
+        response_time = (end_time - start_time).total_seconds()
+        update_analytics(user_input, bot_response, response_time)
+        update_context(user_input, bot_response, session_id)
+    return bot_response
+
+# Souběžné dotazy se stejným promptem čekají na jedno volání modelu
+response_flight = SingleFlight()
+
+# Do mezipaměti odpovědí smí jen odpověď na obecný dotaz: prompt bez historie
+# a kontextu sezení má jen úvodní systémovou zprávu a otázku uživatele
+def is_generic_request(chat_request):
+    return len(chat_request['messages']) == 2
+
+# Klíč pro slučování dotazů je hash celého dotazu na model. Prompt obsahuje
+# historii a kontext sezení, takže se sloučí jen dotazy, které by model dostal
+# beze zbytku stejné, a žádné sezení nedostane odpověď postavenou na cizích výměnách.
+def chat_request_key(chat_request, language):
+    payload = json.dumps([language, chat_request], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Sestavení dotazu na model pro sezení, vrací (dotaz v češtině, parametry dotazu)
+def prepare_bata_request(user_input, language, session_id):
+    # Získání relevantního kontextu
+    relevant_context = get_relevant_context(user_input, session_id)
+    
+    # Překlad vstupu do češtiny, pokud není v češtině
+    if language != 'cs':
+        user_input = translate_text(user_input, 'cs')
+    
+    return user_input, build_chat_request(user_input, relevant_context, get_recent_history(session_id))
+
+# Vlastní volání modelu s hotovým dotazem, vrací odpověď v jazyce uživatele
+def complete_bata_request(chat_request, language):
+    with timed('llm'):
+        response = openai_service.call_hedged(get_client('openai').chat.completions.create, **chat_request)
+    
+    bot_response = response.choices[0].message.content.strip()
+    
+    # Překlad odpovědi zpět do původního jazyka, pokud není čeština
+    if language != 'cs':
+        bot_response = translate_text(bot_response, language)
+    return bot_response
+
+# Získání odpovědi od modelu bez slučování, vrací (dotaz v češtině, odpověď)
+def request_bata_response(user_input, language, session_id):
+    user_input, chat_request = prepare_bata_request(user_input, language, session_id)
+    return user_input, complete_bata_request(chat_request, language)
+
+def generate_bata_response(user_input, language='cs', session_id=None):
     try:
         start_time = datetime.now()
+        if session_id is None:
+            session_id = get_session_id()
         
-        # Získání relevantního kontextu
-        relevant_context = get_relevant_context(user_input)
-        context = bata_context
-        if relevant_context:
-            context += f"\nPředchozí relevantní konverzace:\nOtázka: {relevant_context[0]}\nOdpověď: {relevant_context[1]}"
-        
-        # Překlad vstupu do češtiny, pokud není v češtině
-        if language != 'cs':
-            user_input = translate_text(user_input, 'cs')
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": context},
-                {"role": "user", "content": user_input}
-            ],
-            max_tokens=150,
-            n=1,
-            stop=None,
-            temperature=0.7
-        )
-        
-        bot_response = response.choices[0].message.content.strip()
+        cached_response = get_cached_response(user_input, language, session_id)
+        if cached_response is not None:
+            return cached_response
+        original_input = user_input
         
-        # Překlad odpovědi zpět do původního jazyka, pokud není čeština
-        if language != 'cs':
-            bot_response = translate_text(bot_response, language)
+        user_input, chat_request = prepare_bata_request(user_input, language, session_id)
+        bot_response, shared = response_flight.do(
+            chat_request_key(chat_request, language), complete_bata_request, chat_request, language)
         
-        # Aktualizace analytiky a kontextu
+        # Aktualizace analytiky a kontextu (za každé sezení, mezipaměť a archiv jen jednou)
         end_time = datetime.now()
         response_time = (end_time - start_time).total_seconds()
         update_analytics(user_input, bot_response, response_time)
-        update_context(user_input, bot_response)
+        update_context(user_input, bot_response, session_id)
+        if not shared:
+            if is_generic_request(chat_request):
+                response_cache.set(original_input, language, bot_response)
+            archive_turn(original_input, bot_response, language)
         
         return bot_response
+    except OverloadedError:
+        raise  # Vyřídí se odpovědí 429
+    except CircuitOpenError as e:
+        print(f"Chyba při generování odpovědi: {str(e)}")
+        return "Omlouvám se, ale jsem teď přetížený. Zkuste to prosím za chvíli."
     except Exception as e:
         print(f"Chyba při generování odpovědi: {str(e)}")
         return "Omlouvám se, ale nastala chyba při generování odpovědi."
+
+sentence_end = re.compile(r'(?<=[.!?…])\s+')
+
+# Funkce pro rozdělení textu na dokončené věty a nedokončený zbytek
+def split_sentences(text):
+    parts = sentence_end.split(text)
+    return [part for part in parts[:-1] if part.strip()], parts[-1]
+
+# Streamovaná varianta generate_bata_response, postupně vrací části odpovědi.
+# Pro jiné jazyky než češtinu se překládá po celých větách.
+def stream_bata_response(user_input, language='cs', session_id=None):
+    emitted = []
+    try:
+        start_time = datetime.now()
+        if session_id is None:
+            session_id = get_session_id()
+        
+        cached_response = get_cached_response(user_input, language, session_id)
+        if cached_response is not None:
+            emitted.append(cached_response)
+            yield cached_response
+            return
+        original_input = user_input
+        
+        user_input, chat_request = prepare_bata_request(user_input, language, session_id)
+        
+        llm_start = time.perf_counter()
+        stream = openai_service.stream(get_client('openai').chat.completions.create, **chat_request, stream=True)
+        pending = ''
+        first_token = True
+        for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if first_token:
+                observe_stage('llm_first_token', time.perf_counter() - llm_start)
+                first_token = False
+            delta = chunk.choices[0].delta.content
+            if language == 'cs':
+                emitted.append(delta)
+                yield delta
+                continue
+            pending += delta
+            sentences, pending = split_sentences(pending)
+            for sentence in sentences:
+                translated = translate_text(sentence, language) + ' '
+                emitted.append(translated)
+                yield translated
+        if pending.strip():
+            translated = translate_text(pending, language)
+            emitted.append(translated)
+            yield translated
+        observe_stage('llm', time.perf_counter() - llm_start)
+        
+        bot_response = ''.join(emitted).strip()
+        end_time = datetime.now()
+        response_time = (end_time - start_time).total_seconds()
+        update_analytics(user_input, bot_response, response_time)
+        update_context(user_input, bot_response, session_id)
+        if is_generic_request(chat_request):
+            response_cache.set(original_input, language, bot_response)
+        archive_turn(original_input, bot_response, language)
+    except Exception as e:
+        print(f"Chyba při generování odpovědi: {str(e)}")
+        if not emitted:
+            yield "Omlouvám se, ale nastala chyba při generování odpovědi."
+
+# Vlákna pro syntézu jednotlivých vět během streamování odpovědi
+TTS_PIPELINE_WORKERS = int(os.environ.get('BATA_TTS_PIPELINE_WORKERS', 4))
+tts_executor = ThreadPoolExecutor(max_workers=TTS_PIPELINE_WORKERS, thread_name_prefix='bata-tts')
+
+# Funkce pro zformátování události Server-Sent Events
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.route('/text_chat', methods=['POST'])
 def text_chat():
     try:
@@ -173,14 +2360,19 @@ def text_chat():
         language = data.get('language', 'cs')
         voice = data.get('voice', 'default')
         speech_rate = float(data.get('speech_rate', 1.0))
+        audio_format = get_audio_format(data.get('audio_format'))
         
         if not user_input:
             return jsonify({'error': 'Chybí vstupní text'}), 400
         
-        # Zpracování hlasových příkazů
-        command_response = process_voice_command(user_input)
+        # Zpracování hlasových příkazů a častých dotazů
+        command_response = process_voice_command(user_input, language)
         if command_response:
-            return jsonify({'response': command_response})
+            return jsonify({
+                'response': command_response,
+                'audio_url': reply_audio_url(command_response, language, voice, speech_rate, audio_format),
+                'audio_duration': len(command_response) * 100
+            })
         
         response = generate_bata_response(user_input, language)
         
@@ -188,17 +2380,94 @@ def text_chat():
             return jsonify({'error': 'Nepodařilo se vygenerovat odpověď'}), 500
         
         # Převod textu na řeč
-        audio_content = text_to_speech(response, language, voice, speech_rate)
+        audio_url = reply_audio_url(response, language, voice, speech_rate, audio_format)
         
         return jsonify({
             'response': response,
-            'audio': base64.b64encode(audio_content).decode('utf-8'),
+            'audio_url': audio_url,
             'audio_duration': len(response) * 100  # Přibližně 100ms na znak
         })
+    except OverloadedError:
+        raise
     except Exception as e:
         print(f"Chyba v text_chat: {str(e)}")
         return jsonify({'error': f'Nastala neočekávaná chyba: {str(e)}'}), 500
 
+@app.route('/text_chat_stream', methods=['POST'])
+def text_chat_stream():
+    data = request.json or {}
+    user_input = data.get('text', '')
+    language = data.get('language', 'cs')
+    voice = data.get('voice', 'default')
+    speech_rate = float(data.get('speech_rate', 1.0))
+    audio_format = get_audio_format(data.get('audio_format'))
+    
+    if not user_input:
+        return jsonify({'error': 'Chybí vstupní text'}), 400
+    
+    # Práce se sezením musí proběhnout před odesláním hlaviček odpovědi
+    command_response = process_voice_command(user_input, language)
+    session_id = get_session_id()
+    
+    # Každá dokončená věta se hned posílá do syntézy řeči, zvuk se odesílá
+    # ve stejném pořadí, jakmile je k dispozici
+    def audio_event(index, sentence, job):
+        try:
+            audio_url = job.result()
+        except Exception as e:
+            print(f"Chyba při syntéze věty: {str(e)}")
+            return None
+        return sse_event('audio', {
+            'index': index,
+            'audio_url': audio_url,
+            'audio_duration': len(sentence) * 100  # Přibližně 100ms na znak
+        })
+    
+    def events():
+        if command_response:
+            yield sse_event('token', {'text': command_response})
+            yield sse_event('done', {'response': command_response})
+            audio_url = reply_audio_url(command_response, language, voice, speech_rate, audio_format)
+            if audio_url:
+                yield sse_event('audio', {'index': 0, 'audio_url': audio_url, 'audio_duration': len(command_response) * 100})
+            return
+        try:
+            parts = []
+            pending = ''
+            audio_jobs = deque()
+            sentence_count = 0
+            
+            def submit(sentence):
+                nonlocal sentence_count
+                audio_jobs.append((sentence_count, sentence, tts_executor.submit(contextvars.copy_context().run, text_to_speech_url, sentence, language, voice, speech_rate, audio_format)))
+                sentence_count += 1
+            
+            for text in stream_bata_response(user_input, language, session_id):
+                parts.append(text)
+                yield sse_event('token', {'text': text})
+                pending += text
+                sentences, pending = split_sentences(pending)
+                for sentence in sentences:
+                    submit(sentence)
+                while audio_jobs and audio_jobs[0][2].done():
+                    event = audio_event(*audio_jobs.popleft())
+                    if event:
+                        yield event
+            if pending.strip():
+                submit(pending.strip())
+            
+            yield sse_event('done', {'response': ''.join(parts).strip()})
+            while audio_jobs:
+                event = audio_event(*audio_jobs.popleft())
+                if event:
+                    yield event
+        except Exception as e:
+            print(f"Chyba v text_chat_stream: {str(e)}")
+            yield sse_event('error', {'error': f'Nastala neočekávaná chyba: {str(e)}'})
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/voice_chat', methods=['POST'])
 def voice_chat():
     try:
@@ -209,51 +2478,154 @@ def voice_chat():
         language = request.form.get('language', 'cs')
         voice = request.form.get('voice', 'default')
         speech_rate = float(request.form.get('speech_rate', 1.0))
+        audio_format = get_audio_format(request.form.get('audio_format'))
+        sample_rate = get_speech_sample_rate(request.form.get('sample_rate'))
         
         if audio_file.filename == '':
             return jsonify({'error': 'Nebyl vybrán žádný soubor'}), 400
         
-        # Uložení dočasného souboru
-        temp_filename = secure_filename(audio_file.filename)
-        audio_file.save(temp_filename)
-
-        # Převod řeči na text
-        with open(temp_filename, "rb") as audio_file:
-            content = audio_file.read()
-        audio = speech_v1.RecognitionAudio(content=content)
-        response = speech_client.recognize(config=speech_config, audio=audio)
-        
-        os.remove(temp_filename)  # Odstranění dočasného souboru
+        # Převod řeči na text (nahrávka se čte přímo z požadavku, bez dočasného souboru)
+        content = audio_file.read()
+        response = recognize_speech(content, language, sample_rate)
 
         if not response.results:
             return jsonify({'error': 'Nepodařilo se rozpoznat text z audio souboru'}), 400
 
         recognized_text = response.results[0].alternatives[0].transcript
 
-        # Zpracování hlasových příkazů
-        command_response = process_voice_command(recognized_text)
+        # Zpracování hlasových příkazů a častých dotazů
+        command_response = process_voice_command(recognized_text, language)
         if command_response:
-            return jsonify({'response': command_response, 'recognized_text': recognized_text})
+            return jsonify({
+                'response_text': command_response,
+                'recognized_text': recognized_text,
+                'audio_url': reply_audio_url(command_response, language, voice, speech_rate, audio_format),
+                'audio_duration': len(command_response) * 100
+            })
 
         # Generování odpovědi
         response_text = generate_bata_response(recognized_text, language)
 
         # Převod odpovědi na řeč
-        audio_content = text_to_speech(response_text, language, voice, speech_rate)
+        audio_url = reply_audio_url(response_text, language, voice, speech_rate, audio_format)
 
         return jsonify({
-            'audio': base64.b64encode(audio_content).decode('utf-8'),
+            'audio_url': audio_url,
             'recognized_text': recognized_text,
             'response_text': response_text,
             'audio_duration': len(response_text) * 100  # Přibližně 100ms na znak
         })
+    except OverloadedError:
+        raise
     except Exception as e:
         print(f"Chyba v voice_chat: {str(e)}")
         return jsonify({'error': f'Nastala neočekávaná chyba při zpracování hlasového vstupu: {str(e)}'}), 500
 
-def text_to_speech(text, language, voice, speech_rate):
-    synthesis_input = texttospeech.SynthesisInput(text=text)
+# Funkce pro převod nahrávky na text
+def recognize_speech(content, language='cs', sample_rate=SPEECH_DEFAULT_SAMPLE_RATE):
+    from google.cloud import speech_v1
+    audio = speech_v1.RecognitionAudio(content=content)
+    with timed('stt'):
+        return speech_service.call(get_client('speech').recognize, config=get_speech_config(language, sample_rate), audio=audio, retry=None)
+
+# Streamované rozpoznávání řeči: prohlížeč posílá úseky z MediaRecorder přes WebSocket,
+# server je rovnou předává do StreamingRecognize a vrací průběžné přepisy
+def streaming_recognize(chunks, language='cs', sample_rate=SPEECH_DEFAULT_SAMPLE_RATE):
+    from google.cloud import speech_v1
+    streaming_config = speech_v1.StreamingRecognitionConfig(
+        config=get_speech_config(language, sample_rate),
+        interim_results=True,
+        single_utterance=True
+    )
+    
+    def requests():
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            yield speech_v1.StreamingRecognizeRequest(audio_content=chunk)
     
+    return get_client('speech').streaming_recognize(config=streaming_config, requests=requests(), retry=None)
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/voice_stream')
+    def voice_stream(ws):
+        language = request.args.get('language', 'cs')
+        voice = request.args.get('voice', 'default')
+        speech_rate = float(request.args.get('speech_rate', 1.0))
+        audio_format = get_audio_format(request.args.get('audio_format'))
+        sample_rate = get_speech_sample_rate(request.args.get('sample_rate'))
+        chunks = queue.Queue()
+        
+        # Binární zprávy jsou zvukové úseky, textová zpráva ukončuje nahrávání
+        def receive_chunks():
+            try:
+                while True:
+                    message = ws.receive()
+                    if message is None or isinstance(message, str):
+                        break
+                    chunks.put(message)
+            except Exception:
+                pass
+            finally:
+                chunks.put(None)
+        
+        threading.Thread(target=receive_chunks, daemon=True).start()
+        
+        try:
+            recognized_text = ''
+            with timed('stt_stream'), speech_service.guard():
+                for response in streaming_recognize(chunks, language, sample_rate):
+                    finished = False
+                    for result in response.results:
+                        transcript = result.alternatives[0].transcript
+                        if result.is_final:
+                            recognized_text += transcript
+                            finished = True
+                        elif intent_router.match(recognized_text + transcript, language, kinds=('command',)):
+                            # Příkaz je jasný už z průběžného přepisu, na konec věty se nečeká
+                            recognized_text += transcript
+                            finished = True
+                        else:
+                            ws.send(json.dumps({'type': 'partial', 'text': recognized_text + transcript}, ensure_ascii=False))
+                    if finished:
+                        break
+            chunks.put(None)  # Ukončení generátoru požadavků, další zvuk už není potřeba
+            
+            if not recognized_text:
+                ws.send(json.dumps({'type': 'error', 'error': 'Nepodařilo se rozpoznat text z audio souboru'}, ensure_ascii=False))
+                return
+            ws.send(json.dumps({'type': 'final', 'text': recognized_text}, ensure_ascii=False))
+            
+            command_response = process_voice_command(recognized_text, language)
+            if command_response:
+                ws.send(json.dumps({
+                    'type': 'response',
+                    'audio_url': reply_audio_url(command_response, language, voice, speech_rate, audio_format),
+                    'recognized_text': recognized_text,
+                    'response_text': command_response,
+                    'audio_duration': len(command_response) * 100
+                }, ensure_ascii=False))
+                return
+            
+            response_text = generate_bata_response(recognized_text, language)
+            audio_url = reply_audio_url(response_text, language, voice, speech_rate, audio_format)
+            ws.send(json.dumps({
+                'type': 'response',
+                'audio_url': audio_url,
+                'recognized_text': recognized_text,
+                'response_text': response_text,
+                'audio_duration': len(response_text) * 100  # Přibližně 100ms na znak
+            }, ensure_ascii=False))
+        except Exception as e:
+            chunks.put(None)
+            print(f"Chyba v voice_stream: {str(e)}")
+            ws.send(json.dumps({'type': 'error', 'error': f'Nastala neočekávaná chyba při zpracování hlasového vstupu: {str(e)}'}, ensure_ascii=False))
+
+# Funkce pro výběr hlasu podle jazyka a varianty
+def get_voice_name(language, voice):
     if language == 'cs':
         voice_name = 'cs-CZ-Standard-A'
     elif language == 'en':
@@ -267,24 +2639,407 @@ def text_to_speech(text, language, voice, speech_rate):
         voice_name += '1'
     elif voice == 'alt2':
         voice_name += '2'
+    return voice_name
+
+# Funkce pro sestavení parametrů syntézy řeči
+def build_tts_request(text, language, voice, speech_rate, audio_format=DEFAULT_AUDIO_FORMAT):
+    from google.cloud import texttospeech
+    synthesis_input = texttospeech.SynthesisInput(text=text)
     
     voice = texttospeech.VoiceSelectionParams(
         language_code=language,
-        name=voice_name,
+        name=get_voice_name(language, voice),
         ssml_gender=texttospeech.SsmlVoiceGender.MALE
     )
     
+    audio_options = AUDIO_FORMATS[audio_format]
     audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3,
-        speaking_rate=speech_rate
+        audio_encoding=texttospeech.AudioEncoding[audio_options['encoding']],
+        speaking_rate=speech_rate,
+        sample_rate_hertz=audio_options['sample_rate']
     )
     
-    response = tts_client.synthesize_speech(
-        input=synthesis_input, voice=voice, audio_config=audio_config
-    )
+    return dict(input=synthesis_input, voice=voice, audio_config=audio_config)
+
+# Nastavení mezipaměti syntetizované řeči
+TTS_CACHE_MAX_BYTES = int(os.environ.get('BATA_TTS_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+TTS_CACHE_DIR = os.environ.get('BATA_TTS_CACHE_DIR')  # Volitelná disková vrstva
+AUDIO_SOURCE_TTL = 7 * 24 * 3600  # Doba uchování zvuku a jeho parametrů ve sdíleném úložišti (v sekundách)
+
+# Mezipaměť zvuku adresovaná obsahem: v paměti LRU omezená velikostí, na disku volitelně bez limitu
+class TTSCache:
+    def __init__(self, max_bytes=TTS_CACHE_MAX_BYTES, directory=TTS_CACHE_DIR, backend=None):
+        self.memory = LRUCache(max_bytes=max_bytes)
+        self.directory = directory
+        self.backend = backend  # Sdílené úložiště pro procesy na jiných strojích
+        self.packs = []  # Namapované balíčky předem vygenerovaných odpovědí
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.pack_hits = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(text, language, voice_name, speaking_rate, audio_format='mp3'):
+        parts = [text, language, voice_name, float(speaking_rate)]
+        if audio_format != 'mp3':
+            parts.append(audio_format)  # Klíče MP3 zůstávají stejné jako dřív, platí i starší balíčky a disk
+        payload = json.dumps(parts, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        audio_content = self.memory.get(key)
+        if audio_content is not None:
+            return audio_content
+        for pack in self.packs:
+            audio_content = pack.audio(key)
+            if audio_content is not None:
+                self.pack_hits += 1
+                self.memory.set(key, audio_content)
+                return audio_content
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as cached_file:
+                    audio_content = cached_file.read()
+                self.disk_hits += 1
+            except FileNotFoundError:
+                pass
+        if audio_content is None and self.backend is not None:
+            audio_content = self.backend.get(f"tts:{key}")
+            if audio_content is not None:
+                self.shared_hits += 1
+        if audio_content is not None:
+            self.memory.set(key, audio_content)
+        return audio_content
+
+    def set(self, key, audio_content):
+        self.memory.set(key, audio_content)
+        if self.directory:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, 'wb') as cached_file:
+                cached_file.write(audio_content)
+            os.replace(temp_path, path)  # Atomický zápis, souběžní čtenáři nevidí poloviční soubor
+        elif self.backend is not None:
+            self.backend.set(f"tts:{key}", audio_content, AUDIO_SOURCE_TTL)
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats['disk_hits'] = self.disk_hits
+        stats['shared_hits'] = self.shared_hits
+        stats['pack_hits'] = self.pack_hits
+        return stats
+
+tts_cache = TTSCache(backend=state_backend)
+
+# Souběžné syntézy stejného textu se stejným hlasem čekají na jedno volání
+tts_flight = SingleFlight()
+
+def synthesize_speech(key, text, language, voice, speech_rate, audio_format):
+    with timed('tts'):
+        response = tts_service.call(get_client('tts').synthesize_speech, **build_tts_request(text, language, voice, speech_rate, audio_format), retry=None)
+    tts_cache.set(key, response.audio_content)
+    return response.audio_content
+
+def text_to_speech(text, language, voice, speech_rate, audio_format=DEFAULT_AUDIO_FORMAT):
+    key = TTSCache.key(text, language, get_voice_name(language, voice), speech_rate, audio_format)
+    audio_content = tts_cache.get(key)
+    if audio_content is None:
+        audio_content, _ = tts_flight.do(key, synthesize_speech, key, text, language, voice, speech_rate, audio_format)
+    return audio_content
+
+# Parametry syntézy podle ID zvuku, aby šel záznam vyřazený z mezipaměti znovu vytvořit
+audio_sources = create_cache('audio', ttl=AUDIO_SOURCE_TTL, max_items=int(os.environ.get('BATA_AUDIO_SOURCES_SIZE', 10000)))
+
+# Funkce pro zaregistrování zvuku a vytvoření jeho URL adresované obsahem
+def register_audio(text, language, voice, speech_rate, audio_format=DEFAULT_AUDIO_FORMAT):
+    audio_id = TTSCache.key(text, language, get_voice_name(language, voice), speech_rate, audio_format)
+    audio_sources.set(audio_id, (text, language, voice, speech_rate, audio_format))
+    return f"/audio/{audio_id}.{audio_format}"
+
+# Syntéza řeči, která místo obsahu vrací odkaz na endpoint /audio
+def text_to_speech_url(text, language, voice, speech_rate, audio_format=DEFAULT_AUDIO_FORMAT):
+    text_to_speech(text, language, voice, speech_rate, audio_format)
+    return register_audio(text, language, voice, speech_rate, audio_format)
+
+# ID zvuku je hash SHA-256, nic jiného se do cesty na disku ani do úložiště nedostane
+audio_id_pattern = re.compile(r'[0-9a-f]{64}')
+
+# Formát podle obsahu: OGG začíná značkou kontejneru, vše ostatní je MP3. Přípona
+# v adrese se podle něj ověřuje, ID samo formát neurčuje (klíče MP3 ho neobsahují).
+def detect_audio_format(audio_content):
+    return 'ogg' if audio_content[:4] == b'OggS' else 'mp3'
+
+# Funkce pro načtení zvuku podle ID z mezipaměti, případně jeho opětovná syntéza
+def load_audio(audio_id):
+    if not audio_id_pattern.fullmatch(audio_id):
+        return None
+    audio_content = tts_cache.get(audio_id)
+    if audio_content is None:
+        source = audio_sources.get(audio_id)
+        if source is not None:
+            audio_content = text_to_speech(*source)
+    return audio_content
+
+# Balíček předem vygenerovaných odpovědí a jejich zvuku (soubor .pack):
+#   8 B  značka formátu
+#   8 B  délka hlavičky (little endian)
+#   hlavička JSON: verze, čas vytvoření a položky (otázka, jazyk, odpověď, zvuk podle klíče TTS)
+#   data: zvuk (MP3 nebo OGG) za sebou, v hlavičce je u každého klíče (posun, délka)
+# Zvuk se z namapovaného souboru čte až při použití, stránky souboru tak sdílejí
+# všechny pracovní procesy v mezipaměti operačního systému.
+ANSWER_PACK_MAGIC = b'BATAPAK1'
+ANSWER_PACK_PATH = os.environ.get('BATA_ANSWER_PACK')  # Balíček načtený při startu
+
+class AnswerPack:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as pack_file:
+            self.data = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:8] != ANSWER_PACK_MAGIC:
+            raise ValueError(f"Neplatný balíček odpovědí: {path}")
+        header_length = int.from_bytes(self.data[8:16], 'little')
+        self.header = json.loads(self.data[16:16 + header_length])
+        self.base = 16 + header_length
+        self.version = self.header['version']
+        self.entries = self.header['entries']
+        self.audio_index = {key: location for entry in self.entries for key, location in entry['audio'].items()}
+
+    def audio(self, key):
+        location = self.audio_index.get(key)
+        if location is None:
+            return None
+        offset, length = location
+        return self.data[self.base + offset:self.base + offset + length]
+
+    # Zápis balíčku; položky mají audio jako slovník klíč TTS -> obsah zvuku
+    @staticmethod
+    def write(path, version, entries):
+        header_entries = []
+        blobs = []
+        locations = {}  # Stejný zvuk (stejný klíč) se uloží jen jednou
+        offset = 0
+        for entry in entries:
+            for key, audio_content in entry['audio'].items():
+                if key not in locations:
+                    locations[key] = (offset, len(audio_content))
+                    blobs.append(audio_content)
+                    offset += len(audio_content)
+            header_entries.append({**entry, 'audio': {key: locations[key] for key in entry['audio']}})
+        header = json.dumps({'version': version, 'created': datetime.now().isoformat(timespec='seconds'), 'entries': header_entries}, ensure_ascii=False).encode('utf-8')
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as pack_file:
+            pack_file.write(ANSWER_PACK_MAGIC)
+            pack_file.write(len(header).to_bytes(8, 'little'))
+            pack_file.write(header)
+            for blob in blobs:
+                pack_file.write(blob)
+        os.replace(temp_path, path)
+
+    def stats(self):
+        return {'version': self.version, 'entries': len(self.entries), 'audio': len(self.audio_index)}
+
+# Naplnění sémantické mezipaměti odpovědí z balíčku (vektorizace chvíli trvá, běží na pozadí)
+def seed_response_cache(pack):
+    try:
+        for entry in pack.entries:
+            response_cache.set(entry['question'], entry['language'], entry['answer'])
+    except Exception as e:
+        print(f"Chyba při načítání balíčku odpovědí: {str(e)}")
+
+def load_answer_pack(path):
+    pack = AnswerPack(path)
+    tts_cache.packs.append(pack)
+    threading.Thread(target=seed_response_cache, args=(pack,), name='bata-pack-seed', daemon=True).start()
+    return pack
+
+# Sestavení balíčku: odpověď na každou otázku v každém jazyce a její zvuk pro
+# zadané hlasy. Otázky jsou česky; pro ostatní jazyky se nejdřív přeloží, aby
+# klíč v mezipaměti odpovídal tomu, na co se návštěvníci skutečně ptají.
+# Dvojice (otázka, jazyk) se použijí tak, jak jsou.
+def build_answer_pack(path, questions, languages=('cs',), voices=('default',), speech_rate=1.0, version=None, audio_formats=('mp3',)):
+    version = version or datetime.now().strftime('%Y%m%d%H%M%S')
+    entries = []
+    for item in questions:
+        # Otázka je česky, nebo dvojice (otázka, jazyk). Model dostane vždy českou
+        # otázku a odpověď se překládá přímo; položka s nezdařeným překladem se
+        # vynechá, aby se do balíčku nedostal nepřeložený text.
+        pairs = [item] if isinstance(item, tuple) else [(item, language) for language in languages]
+        for question, language in pairs:
+            try:
+                if language == 'cs':
+                    question_cs = question
+                elif isinstance(item, tuple):
+                    question_cs = translate_text_strict(question, 'cs')
+                else:
+                    question_cs, question = question, translate_text_strict(question, language)
+                _, answer = request_bata_response(question_cs, 'cs', f"pack-{uuid.uuid4().hex}")
+                if language != 'cs':
+                    answer = translate_text_strict(answer, language)
+            except Exception as e:
+                print(f"Chyba při generování odpovědi do balíčku ({question}): {str(e)}")
+                continue
+            audio = {}
+            for voice in voices:
+                for audio_format in audio_formats:
+                    key = TTSCache.key(answer, language, get_voice_name(language, voice), speech_rate, audio_format)
+                    audio[key] = text_to_speech(answer, language, voice, speech_rate, audio_format)
+            entries.append({'question': question, 'language': language, 'answer': answer, 'audio': audio})
+    AnswerPack.write(path, version, entries)
+    return version, len(entries)
+
+answer_pack = None
+if ANSWER_PACK_PATH:
+    try:
+        answer_pack = load_answer_pack(ANSWER_PACK_PATH)
+    except Exception as e:
+        print(f"Chyba při načítání balíčku odpovědí: {str(e)}")
+
+# Asynchronní režim: volání OpenAI a Google běží na jedné sdílené smyčce událostí
+# v samostatném vlákně, nezávislé kroky se provádějí souběžně.
+ASYNC_MODE = os.environ.get('BATA_ASYNC_MODE') == '1'
+async_loop = None
+async_loop_lock = threading.Lock()
+async_clients = {}
+
+# Funkce pro získání (a případné spuštění) smyčky událostí
+def get_async_loop():
+    global async_loop
+    with async_loop_lock:
+        if async_loop is None:
+            async_loop = asyncio.new_event_loop()
+            threading.Thread(target=async_loop.run_forever, name='bata-async-loop', daemon=True).start()
+    return async_loop
+
+# Spuštění korutiny na sdílené smyčce, výsledek lze očekávat z libovolné smyčky
+def run_async(coro):
+    return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, get_async_loop()))
+
+# Asynchronní klienti se vytvářejí až uvnitř sdílené smyčky, ke které jsou vázáni
+def get_async_client(name):
+    if name not in async_clients:
+        if name == 'openai':
+            import httpx
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            async_clients[name] = AsyncOpenAI(
+                api_key=get_client('openai').api_key,
+                max_retries=0,
+                timeout=UPSTREAM_TIMEOUTS['openai'],
+                http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(max_connections=UPSTREAM_POOL_SIZE, max_keepalive_connections=UPSTREAM_POOL_SIZE))
+            )
+        elif name == 'speech':
+            from google.cloud import speech_v1
+            async_clients[name] = speech_v1.SpeechAsyncClient()
+        elif name == 'tts':
+            from google.cloud import texttospeech
+            async_clients[name] = texttospeech.TextToSpeechAsyncClient()
+    return async_clients[name]
+
+# Knihovna translate_v2 nemá asynchronního klienta, překlad běží ve vlákně
+async def translate_text_async(text, target_language='cs'):
+    return await asyncio.to_thread(translate_text, text, target_language)
+
+async def prepare_bata_request_async(user_input, language, session_id):
+    # Vyhledání kontextu, historie a překlad vstupu na sobě nezávisí, běží souběžně
+    if language != 'cs':
+        relevant_context, history, user_input = await asyncio.gather(
+            asyncio.to_thread(get_relevant_context, user_input, session_id),
+            asyncio.to_thread(get_recent_history, session_id),
+            translate_text_async(user_input, 'cs')
+        )
+    else:
+        relevant_context, history = await asyncio.gather(
+            asyncio.to_thread(get_relevant_context, user_input, session_id),
+            asyncio.to_thread(get_recent_history, session_id)
+        )
+    return user_input, build_chat_request(user_input, relevant_context, history)
+
+async def complete_bata_request_async(chat_request, language):
+    with timed('llm'):
+        response = await openai_service.call_async(get_async_client('openai').chat.completions.create, **chat_request)
+    bot_response = response.choices[0].message.content.strip()
     
+    if language != 'cs':
+        bot_response = await translate_text_async(bot_response, language)
+    return bot_response
+
+async def generate_bata_response_async(user_input, language, session_id):
+    try:
+        start_time = datetime.now()
+        
+        cached_response = get_cached_response(user_input, language, session_id)
+        if cached_response is not None:
+            return cached_response
+        original_input = user_input
+        
+        user_input, chat_request = await prepare_bata_request_async(user_input, language, session_id)
+        bot_response, shared = await response_flight.do_async(
+            chat_request_key(chat_request, language), complete_bata_request_async, chat_request, language)
+        
+        end_time = datetime.now()
+        response_time = (end_time - start_time).total_seconds()
+        update_analytics(user_input, bot_response, response_time)
+        update_context(user_input, bot_response, session_id)
+        if not shared:
+            if is_generic_request(chat_request):
+                response_cache.set(original_input, language, bot_response)
+            archive_turn(original_input, bot_response, language)
+        
+        return bot_response
+    except OverloadedError:
+        raise  # Vyřídí se odpovědí 429
+    except CircuitOpenError as e:
+        print(f"Chyba při generování odpovědi: {str(e)}")
+        return "Omlouvám se, ale jsem teď přetížený. Zkuste to prosím za chvíli."
+    except Exception as e:
+        print(f"Chyba při generování odpovědi: {str(e)}")
+        return "Omlouvám se, ale nastala chyba při generování odpovědi."
+
+async def synthesize_speech_async(key, text, language, voice, speech_rate, audio_format):
+    with timed('tts'):
+        response = await tts_service.call_async(get_async_client('tts').synthesize_speech, **build_tts_request(text, language, voice, speech_rate, audio_format), retry=None)
+    tts_cache.set(key, response.audio_content)
     return response.audio_content
 
+async def text_to_speech_async(text, language, voice, speech_rate, audio_format=DEFAULT_AUDIO_FORMAT):
+    key = TTSCache.key(text, language, get_voice_name(language, voice), speech_rate, audio_format)
+    audio_content = tts_cache.get(key)
+    if audio_content is None:
+        audio_content, _ = await tts_flight.do_async(key, synthesize_speech_async, key, text, language, voice, speech_rate, audio_format)
+    return audio_content
+
+async def text_to_speech_url_async(text, language, voice, speech_rate, audio_format=DEFAULT_AUDIO_FORMAT):
+    await text_to_speech_async(text, language, voice, speech_rate, audio_format)
+    return register_audio(text, language, voice, speech_rate, audio_format)
+
+async def reply_audio_url_async(text, language, voice, speech_rate, audio_format=DEFAULT_AUDIO_FORMAT):
+    try:
+        return await text_to_speech_url_async(text, language, voice, speech_rate, audio_format)
+    except Exception as e:
+        print(f"Chyba při syntéze odpovědi: {str(e)}")
+        return None
+
+async def recognize_speech_async(content, language='cs', sample_rate=SPEECH_DEFAULT_SAMPLE_RATE):
+    from google.cloud import speech_v1
+    audio = speech_v1.RecognitionAudio(content=content)
+    with timed('stt'):
+        return await speech_service.call_async(get_async_client('speech').recognize, config=get_speech_config(language, sample_rate), audio=audio, retry=None)
+
+# Zvuk se posílá binárně v typu podle přípony (mp3 nebo ogg). ID je hash obsahu
+# včetně formátu, takže se nikdy nemění a prohlížeč i proxy ho mohou trvale uložit.
+@app.route('/audio/<audio_id>.<audio_format>', methods=['GET'])
+def get_audio(audio_id, audio_format):
+    audio_content = load_audio(audio_id) if audio_format in AUDIO_FORMATS else None
+    if audio_content is None or detect_audio_format(audio_content) != audio_format:
+        return jsonify({'error': 'Zvukový záznam nebyl nalezen'}), 404
+    response = send_file(io.BytesIO(audio_content), mimetype=AUDIO_FORMATS[audio_format]['mimetype'], conditional=True, etag=audio_id)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/update_settings', methods=['POST'])
 def update_settings():
     data = request.json
@@ -297,23 +3052,179 @@ def update_settings():
     }
     return jsonify({'message': 'Nastavení aktualizováno'})
 
-@app.route('/get_settings', methods=['GET'])
-def get_settings():
-    return jsonify(session.get('user_settings', {
-        'theme': 'light',
-        'font_size': 'medium',
-        'language': 'cs',
-        'voice': 'default',
-        'speech_rate': 1.0
-    }))
+@app.route('/get_settings', methods=['GET'])
+def get_settings():
+    return jsonify(session.get('user_settings', {
+        'theme': 'light',
+        'font_size': 'medium',
+        'language': 'cs',
+        'voice': 'default',
+        'speech_rate': 1.0
+    }))
+
+@app.route('/analytics', methods=['GET'])
+def get_analytics():
+    return jsonify(analytics.snapshot())
+
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({
+        'tts': tts_cache.stats(),
+        'translation': translation_cache.stats(),
+        'response': response_cache.stats(),
+        'coalesced': {'response': response_flight.coalesced, 'tts': tts_flight.coalesced},
+        'intents': intent_router.stats(),
+        'answer_pack': answer_pack.stats() if answer_pack else None
+    })
+
+# Správcovské endpointy jsou dostupné jen s tokenem z BATA_ADMIN_TOKEN
+# (hlavička X-Admin-Token nebo Authorization: Bearer), bez něj jsou vypnuté
+ADMIN_TOKEN = os.environ.get('BATA_ADMIN_TOKEN', '')
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Správa není zapnutá'}), 403
+        token = request.headers.get('X-Admin-Token', '')
+        authorization = request.headers.get('Authorization', '')
+        if not token and authorization.startswith('Bearer '):
+            token = authorization[len('Bearer '):]
+        if not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'Neplatný token správce'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/response_cache/invalidate', methods=['POST'])
+@admin_required
+def invalidate_response_cache():
+    data = request.get_json(silent=True) or {}
+    response_cache.invalidate(data.get('language'), data.get('question'))
+    return jsonify({'message': 'Mezipaměť odpovědí byla zneplatněna'})
+
+@app.route('/archive', methods=['GET'])
+def archive_stats():
+    if archive is None:
+        return jsonify({'error': 'Archiv konverzací není zapnutý'}), 404
+    return jsonify(archive.stats())
+
+# Kompaktace archivu běží na pozadí, může trvat déle než požadavek
+@app.route('/archive/compact', methods=['POST'])
+@admin_required
+def compact_archive():
+    if archive is None or archive.readonly:
+        return jsonify({'error': 'Archiv konverzací není zapnutý pro zápis'}), 404
+    data = request.get_json(silent=True) or {}
+    max_age_days = data.get('max_age_days')
+    max_age = None
+    if max_age_days is not None:
+        if isinstance(max_age_days, bool) or not isinstance(max_age_days, (int, float)) \
+                or not math.isfinite(max_age_days) or max_age_days <= 0:
+            return jsonify({'error': 'max_age_days musí být kladné číslo'}), 400
+        max_age = max_age_days * 24 * 3600
+
+    def run_compaction():
+        try:
+            print(f"Kompaktace archivu: {archive.compact(max_age)}")
+        except Exception as e:
+            print(f"Chyba při kompaktaci archivu: {str(e)}")
+
+    threading.Thread(target=run_compaction, name='bata-archive-compact', daemon=True).start()
+    return jsonify({'message': 'Kompaktace archivu byla spuštěna'}), 202
+
+# Měření celých požadavků. U streamovaných odpovědí se teardown volá až po
+# odeslání posledního bloku, takže se měří celá doba streamu.
+@app.before_request
+def start_request_trace():
+    g.request_start = time.perf_counter()
+    if TRACE_LOG:
+        current_trace.set({'trace_id': uuid.uuid4().hex, 'endpoint': request.endpoint, 'spans': []})
+
+# Řízení přístupu pro chatovací endpointy: text má přednost před hlasem, první
+# dotaz sezení před navazujícími. Pokud hlavní služba požadavek nestihne
+# obsloužit do termínu, odmítne se hned odpovědí 429.
+admission_endpoints = {'text_chat': False, 'text_chat_stream': False, 'voice_chat': True, 'voice_stream': True}
+
+@app.before_request
+def admit_request():
+    current_admission.set(None)
+    if request.endpoint not in admission_endpoints:
+        return None
+    voice = admission_endpoints[request.endpoint]
+    session_id = get_session_id()
+    follow_up = bool(session_memory.get(session_id).recent)
+    priority = 2 * voice + follow_up
+    current_admission.set((priority, session_id))
+    deadline = time.monotonic() + ADMISSION_QUEUE_TIMEOUT
+    retry_after = (speech_service if voice else openai_service).admission.rejection(priority, deadline)
+    if retry_after is not None:
+        return overloaded_response(retry_after)
+    return None
 
-@app.route('/analytics', methods=['GET'])
-def get_analytics():
-    return jsonify(analytics_data)
+def overloaded_response(retry_after):
+    response = jsonify({'error': 'Server je momentálně přetížený, zkuste to prosím za chvíli'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+@app.errorhandler(OverloadedError)
+def handle_overloaded(error):
+    return overloaded_response(error.retry_after)
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    g.response_streamed = response.is_streamed
+    return response
+
+@app.teardown_request
+def finish_request_trace(error):
+    if 'request_start' not in g:
+        return
+    # Streamovaná odpověď projde teardown dvakrát: po návratu z view a po doběhnutí streamu
+    if g.pop('response_streamed', False):
+        return
+    duration = time.perf_counter() - g.request_start
+    status = g.get('response_status', 500)
+    metrics.observe('bata_request_duration_seconds', {'endpoint': request.endpoint or 'unknown', 'status': status},
+                    duration, error is not None or status >= 500)
+    trace = current_trace.get()
+    if trace is not None:
+        trace['status'] = status
+        trace['duration_ms'] = round(duration * 1000, 2)
+        print(json.dumps(trace, ensure_ascii=False), flush=True)
+        current_trace.set(None)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    lines = metrics.render()
+    lines.append("# TYPE bata_cache_hits_total counter")
+    lines.append("# TYPE bata_cache_misses_total counter")
+    cache_stats = {'tts': tts_cache.stats(), 'translation': translation_cache.stats(), 'response': response_cache.stats()}
+    for cache, stats in cache_stats.items():
+        lines.append(f'bata_cache_hits_total{{cache="{cache}"}} {stats["hits"]}')
+        lines.append(f'bata_cache_misses_total{{cache="{cache}"}} {stats["misses"]}')
+    lines.append("# TYPE bata_coalesced_calls_total counter")
+    for name, flight in (('response', response_flight), ('tts', tts_flight)):
+        lines.append(f'bata_coalesced_calls_total{{call="{name}"}} {flight.coalesced}')
+    lines.append("# TYPE bata_upstream_circuit_open gauge")
+    for service in upstream_services:
+        lines.append(f'bata_upstream_circuit_open{{service="{service.name}"}} {int(service.breaker.state != "closed")}')
+    lines.append("# TYPE bata_conversations_total counter")
+    lines.append(f'bata_conversations_total {analytics.snapshot()["total_conversations"]}')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({
+        'upstream': {service.name: service.breaker.state for service in upstream_services},
+        'admission': {service.name: service.admission.stats() for service in upstream_services}
+    })
 
 @app.route('/clear_history', methods=['POST'])
 def clear_history():
     session['conversation_history'] = []
+    session_memory.clear(get_session_id())
     return jsonify({'message': 'Historie úspěšně smazána'})
 
 @app.route('/provide_feedback', methods=['POST'])
@@ -321,23 +3232,101 @@ def provide_feedback():
     data = request.json
     feedback_type = data.get('feedback_type')
     
-    if feedback_type == 'positive':
-        analytics_data['feedback']['positive'] += 1
-    elif feedback_type == 'negative':
-        analytics_data['feedback']['negative'] += 1
+    analytics.record_feedback(feedback_type)
     
     return jsonify({'message': 'Zpětná vazba byla zaznamenána'})
 
-# HTML šablona
-html_template = """
-<!DOCTYPE html>
-<html lang="cs">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Baťův Inovativní Chatbot</title>
-    <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@300;400;700&display=swap" rel="stylesheet">
-    <style>
+# Asynchronní varianty chatovacích endpointů (vyžadují flask[async])
+async def text_chat_async():
+    try:
+        data = request.json
+        user_input = data.get('text', '')
+        language = data.get('language', 'cs')
+        voice = data.get('voice', 'default')
+        speech_rate = float(data.get('speech_rate', 1.0))
+        audio_format = get_audio_format(data.get('audio_format'))
+        
+        if not user_input:
+            return jsonify({'error': 'Chybí vstupní text'}), 400
+        
+        command_response = process_voice_command(user_input, language)
+        if command_response:
+            return jsonify({
+                'response': command_response,
+                'audio_url': reply_audio_url(command_response, language, voice, speech_rate, audio_format),
+                'audio_duration': len(command_response) * 100
+            })
+        
+        response = await run_async(generate_bata_response_async(user_input, language, get_session_id()))
+        
+        if not response:
+            return jsonify({'error': 'Nepodařilo se vygenerovat odpověď'}), 500
+        
+        audio_url = await run_async(reply_audio_url_async(response, language, voice, speech_rate, audio_format))
+        
+        return jsonify({
+            'response': response,
+            'audio_url': audio_url,
+            'audio_duration': len(response) * 100  # Přibližně 100ms na znak
+        })
+    except OverloadedError:
+        raise
+    except Exception as e:
+        print(f"Chyba v text_chat: {str(e)}")
+        return jsonify({'error': f'Nastala neočekávaná chyba: {str(e)}'}), 500
+
+async def voice_chat_async():
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'Žádný audio soubor nebyl nahrán'}), 400
+        
+        audio_file = request.files['file']
+        language = request.form.get('language', 'cs')
+        voice = request.form.get('voice', 'default')
+        speech_rate = float(request.form.get('speech_rate', 1.0))
+        audio_format = get_audio_format(request.form.get('audio_format'))
+        sample_rate = get_speech_sample_rate(request.form.get('sample_rate'))
+        
+        if audio_file.filename == '':
+            return jsonify({'error': 'Nebyl vybrán žádný soubor'}), 400
+        
+        response = await run_async(recognize_speech_async(audio_file.read(), language, sample_rate))
+        
+        if not response.results:
+            return jsonify({'error': 'Nepodařilo se rozpoznat text z audio souboru'}), 400
+        
+        recognized_text = response.results[0].alternatives[0].transcript
+        
+        command_response = process_voice_command(recognized_text, language)
+        if command_response:
+            return jsonify({
+                'response_text': command_response,
+                'recognized_text': recognized_text,
+                'audio_url': reply_audio_url(command_response, language, voice, speech_rate, audio_format),
+                'audio_duration': len(command_response) * 100
+            })
+        
+        response_text = await run_async(generate_bata_response_async(recognized_text, language, get_session_id()))
+        audio_url = await run_async(reply_audio_url_async(response_text, language, voice, speech_rate, audio_format))
+        
+        return jsonify({
+            'audio_url': audio_url,
+            'recognized_text': recognized_text,
+            'response_text': response_text,
+            'audio_duration': len(response_text) * 100  # Přibližně 100ms na znak
+        })
+    except OverloadedError:
+        raise
+    except Exception as e:
+        print(f"Chyba v voice_chat: {str(e)}")
+        return jsonify({'error': f'Nastala neočekávaná chyba při zpracování hlasového vstupu: {str(e)}'}), 500
+
+if ASYNC_MODE:
+    app.view_functions['text_chat'] = text_chat_async
+    app.view_functions['voice_chat'] = voice_chat_async
+
+# Styly stránky (servírují se jako samostatný soubor s otiskem v názvu)
+style_source = """
         :root {
             --primary-color: #FF4500;
             --secondary-color: #1E90FF;
@@ -347,7 +3336,7 @@ html_template = """
         }
 
         body {
-            font-family: 'Roboto', sans-serif;
+            font-family: 'Roboto', system-ui, -apple-system, 'Segoe UI', Arial, sans-serif;
             background-color: var(--background-color);
             color: var(--text-color);
             margin: 0;
@@ -594,62 +3583,10 @@ html_template = """
                 order: 1;
             }
         }
-    </style>
-</head>
-<body>
-    <div class="chat-container">
-        <div class="sidebar">
-            <div class="avatar-container">
-                <div class="face"></div>
-                <div class="hair"></div>
-                <div class="eyes">
-                    <div class="eye"></div>
-                    <div class="eye"></div>
-                </div>
-                <div class="mouth"></div>
-                <div class="suit"></div>
-                <div class="tie"></div>
-            </div>
-            <h1>Tomáš Baťa AI</h1>
-            <div class="settings">
-                <h2>Nastavení</h2>
-                <div class="setting-item">
-                    <label for="theme">Téma:</label>
-                    <select id="theme">
-                        <option value="light">Světlé</option>
-                        <option value="dark">Tmavé</option>
-                    </select>
-                </div>
-                <div class="setting-item">
-                    <label for="language">Jazyk:</label>
-                    <select id="language">
-                        <option value="cs">Čeština</option>
-                        <option value="en">Angličtina</option>
-                        <option value="de">Němčina</option>
-                    </select>
-                </div>
-            </div>
-            <div class="analytics">
-                <h2>Analytika</h2>
-                <div class="analytic-item">Konverzace: <span id="conversation-count">0</span></div>
-                <div class="analytic-item">Zprávy: <span id="message-count">0</span></div>
-            </div>
-        </div>
-        <div class="main-chat">
-            <div class="chat-header">
-                <h2>Inovativní rozhovor s Tomášem Baťou</h2>
-            </div>
-            <div class="chat-messages" id="chat-messages">
-                <!-- Zprávy budou dynamicky přidávány zde -->
-            </div>
-            <div class="chat-input">
-                <input type="text" id="user-input" placeholder="Napište svou zprávu...">
-                <button id="send-button">Odeslat</button>
-                <button id="voice-button">Nahrát hlas</button>
-            </div>
-        </div>
-    </div>
-    <script>
+"""
+
+# Skript stránky
+script_source = """
         document.addEventListener('DOMContentLoaded', () => {
             const chatMessages = document.getElementById('chat-messages');
             const userInput = document.getElementById('user-input');
@@ -659,6 +3596,18 @@ html_template = """
             const languageSelect = document.getElementById('language');
             const mouth = document.querySelector('.mouth');
 
+            const voiceStreaming = document.body.dataset.voiceStreaming === 'true';
+
+            // Opus v OGG je menší, MP3 je záloha pro prohlížeče, které ho nepřehrají
+            const audioFormat = new Audio().canPlayType('audio/ogg; codecs="opus"') ? 'ogg' : 'mp3';
+            // Prohlížeče kódují Opus ve WebM vždy s frekvencí 48 kHz (požadovaná frekvence
+            // mikrofonu je jen nápověda), menší nahrávku zajistí mono a nízký datový tok
+            const recordingSampleRate = 48000;
+            const recordingOptions = { audioBitsPerSecond: 24000 };
+            if (window.MediaRecorder && MediaRecorder.isTypeSupported('audio/webm;codecs=opus')) {
+                recordingOptions.mimeType = 'audio/webm;codecs=opus';
+            }
+
             let mediaRecorder;
             let audioChunks = [];
 
@@ -666,26 +3615,34 @@ html_template = """
                 const message = userInput.value.trim();
                 if (message) {
                     appendMessage('Vy: ' + message, 'user-message');
-                    fetch('/text_chat', {
+                    const botMessage = appendMessage('Tomáš Baťa: ', 'bot-message');
+                    fetch('/text_chat_stream', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
                         },
                         body: JSON.stringify({
                             text: message,
-                            language: languageSelect.value
+                            language: languageSelect.value,
+                            audio_format: audioFormat
                         }),
                     })
-                    .then(response => response.json())
-                    .then(data => {
-                        if (data.response) {
-                            appendMessage('Tomáš Baťa: ' + data.response, 'bot-message');
-                            playAudioResponse(data.audio);
-                            animateMouth(data.audio_duration);
-                        }
-                        updateAnalytics();
+                    .then(response => {
+                        if (!response.ok) throw new Error('HTTP ' + response.status);
+                        return readEventStream(response, (event, data) => {
+                            if (event === 'token') {
+                                botMessage.textContent += data.text;
+                                chatMessages.scrollTop = chatMessages.scrollHeight;
+                            } else if (event === 'audio') {
+                                playAudioResponse(data.audio_url, data.audio_duration);
+                            } else if (event === 'error') {
+                                throw new Error(data.error);
+                            }
+                        });
                     })
+                    .then(() => updateAnalytics())
                     .catch(error => {
+                        botMessage.remove();
                         console.error('Error:', error);
                         appendMessage('Chyba: Nepodařilo se získat odpověď.', 'error-message');
                     });
@@ -699,11 +3656,58 @@ html_template = """
                 messageElement.className = `message ${className}`;
                 chatMessages.appendChild(messageElement);
                 chatMessages.scrollTop = chatMessages.scrollHeight;
+                return messageElement;
             }
 
-            function playAudioResponse(audioBase64) {
-                const audio = new Audio(`data:audio/mp3;base64,${audioBase64}`);
-                audio.play();
+            // Čtení proudu Server-Sent Events z odpovědi fetch (EventSource neumí POST)
+            function readEventStream(response, onEvent) {
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                function pump() {
+                    return reader.read().then(({ done, value }) => {
+                        if (done) return;
+                        buffer += decoder.decode(value, { stream: true });
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                            const rawEvent = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+                            let event = 'message';
+                            let data = '';
+                            rawEvent.split('\\n').forEach(line => {
+                                if (line.startsWith('event: ')) event = line.slice(7);
+                                else if (line.startsWith('data: ')) data += line.slice(6);
+                            });
+                            onEvent(event, JSON.parse(data));
+                        }
+                        return pump();
+                    });
+                }
+                return pump();
+            }
+
+            // Fronta zvukových úseků, přehrávají se postupně za sebou
+            const audioQueue = [];
+            let audioPlaying = false;
+
+            function playAudioResponse(audioUrl, duration) {
+                if (!audioUrl) return;  // Odpověď bez zvuku (syntéza selhala)
+                audioQueue.push({ audioUrl, duration });
+                if (!audioPlaying) playNextAudio();
+            }
+
+            function playNextAudio() {
+                const next = audioQueue.shift();
+                if (!next) {
+                    audioPlaying = false;
+                    return;
+                }
+                audioPlaying = true;
+                const audio = new Audio(next.audioUrl);
+                audio.addEventListener('ended', playNextAudio);
+                audio.addEventListener('error', playNextAudio);
+                audio.play().catch(playNextAudio);
+                animateMouth(next.duration);
             }
 
             function animateMouth(duration) {
@@ -721,9 +3725,13 @@ html_template = """
             }
 
             function startVoiceRecording() {
-                navigator.mediaDevices.getUserMedia({ audio: true })
+                navigator.mediaDevices.getUserMedia({ audio: { channelCount: 1 } })
                     .then(stream => {
-                        mediaRecorder = new MediaRecorder(stream);
+                        if (voiceStreaming && window.WebSocket) {
+                            startStreamingRecognition(stream);
+                            return;
+                        }
+                        mediaRecorder = new MediaRecorder(stream, recordingOptions);
                         mediaRecorder.start();
 
                         audioChunks = [];
@@ -740,6 +3748,50 @@ html_template = """
                     });
             }
 
+            // Úseky nahrávky jdou přes WebSocket rovnou do rozpoznávání, přepis se zobrazuje průběžně
+            function startStreamingRecognition(stream) {
+                const params = new URLSearchParams({
+                    language: languageSelect.value,
+                    audio_format: audioFormat,
+                    sample_rate: recordingSampleRate
+                });
+                const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+                const socket = new WebSocket(`${protocol}//${location.host}/voice_stream?${params}`);
+                const transcriptMessage = appendMessage('Vy (hlas): …', 'user-message');
+
+                socket.addEventListener('open', () => {
+                    mediaRecorder = new MediaRecorder(stream, recordingOptions);
+                    mediaRecorder.addEventListener('dataavailable', event => {
+                        if (event.data.size && socket.readyState === WebSocket.OPEN) socket.send(event.data);
+                    });
+                    mediaRecorder.addEventListener('stop', () => {
+                        stream.getTracks().forEach(track => track.stop());
+                        if (socket.readyState === WebSocket.OPEN) socket.send('end');
+                    });
+                    mediaRecorder.start(250);
+                    voiceButton.textContent = 'Zastavit nahrávání';
+                });
+
+                socket.addEventListener('message', event => {
+                    const data = JSON.parse(event.data);
+                    if (data.type === 'partial' || data.type === 'final') {
+                        transcriptMessage.textContent = 'Vy (hlas): ' + data.text;
+                        if (data.type === 'final' && mediaRecorder.state === 'recording') stopVoiceRecording();
+                    } else if (data.type === 'response') {
+                        handleVoiceResponse(data);
+                        socket.close();
+                    } else if (data.type === 'error') {
+                        transcriptMessage.remove();
+                        appendMessage('Chyba: ' + data.error, 'error-message');
+                        socket.close();
+                    }
+                });
+
+                socket.addEventListener('error', () => {
+                    appendMessage('Chyba: Nepodařilo se zpracovat hlasovou zprávu.', 'error-message');
+                });
+            }
+
             function stopVoiceRecording() {
                 if (mediaRecorder) {
                     mediaRecorder.stop();
@@ -747,10 +3799,20 @@ html_template = """
                 }
             }
 
+            function handleVoiceResponse(data) {
+                if (data.response_text) {
+                    appendMessage('Tomáš Baťa: ' + data.response_text, 'bot-message');
+                    if (data.audio_url) playAudioResponse(data.audio_url, data.audio_duration);
+                }
+                updateAnalytics();
+            }
+
             function sendVoiceMessage(audioBlob) {
                 const formData = new FormData();
                 formData.append("file", audioBlob, "voice.webm");
                 formData.append("language", languageSelect.value);
+                formData.append("audio_format", audioFormat);
+                formData.append("sample_rate", recordingSampleRate);
 
                 fetch('/voice_chat', {
                     method: 'POST',
@@ -761,12 +3823,7 @@ html_template = """
                     if (data.recognized_text) {
                         appendMessage('Vy (hlas): ' + data.recognized_text, 'user-message');
                     }
-                    if (data.response_text) {
-                        appendMessage('Tomáš Baťa: ' + data.response_text, 'bot-message');
-                        playAudioResponse(data.audio);
-                        animateMouth(data.audio_duration);
-                    }
-                    updateAnalytics();
+                    handleVoiceResponse(data);
                 })
                 .catch(error => {
                     console.error('Error:', error);
@@ -834,15 +3891,221 @@ html_template = """
             // Počáteční načtení analytiky
             updateAnalytics();
         });
-    </script>
+"""
+
+# HTML šablona
+html_template = """
+<!DOCTYPE html>
+<html lang="cs">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Baťův Inovativní Chatbot</title>
+    {% if google_fonts %}
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+    <link href="https://fonts.googleapis.com/css2?family=Roboto:wght@300;400;700&display=swap" rel="stylesheet">
+    {% endif %}
+    <link rel="stylesheet" href="{{ style_url }}">
+</head>
+<body data-voice-streaming="{{ 'true' if voice_streaming else 'false' }}">
+    <div class="chat-container">
+        <div class="sidebar">
+            <div class="avatar-container">
+                <div class="face"></div>
+                <div class="hair"></div>
+                <div class="eyes">
+                    <div class="eye"></div>
+                    <div class="eye"></div>
+                </div>
+                <div class="mouth"></div>
+                <div class="suit"></div>
+                <div class="tie"></div>
+            </div>
+            <h1>Tomáš Baťa AI</h1>
+            <div class="settings">
+                <h2>Nastavení</h2>
+                <div class="setting-item">
+                    <label for="theme">Téma:</label>
+                    <select id="theme">
+                        <option value="light">Světlé</option>
+                        <option value="dark">Tmavé</option>
+                    </select>
+                </div>
+                <div class="setting-item">
+                    <label for="language">Jazyk:</label>
+                    <select id="language">
+                        <option value="cs">Čeština</option>
+                        <option value="en">Angličtina</option>
+                        <option value="de">Němčina</option>
+                    </select>
+                </div>
+            </div>
+            <div class="analytics">
+                <h2>Analytika</h2>
+                <div class="analytic-item">Konverzace: <span id="conversation-count">0</span></div>
+                <div class="analytic-item">Zprávy: <span id="message-count">0</span></div>
+            </div>
+        </div>
+        <div class="main-chat">
+            <div class="chat-header">
+                <h2>Inovativní rozhovor s Tomášem Baťou</h2>
+            </div>
+            <div class="chat-messages" id="chat-messages">
+                <!-- Zprávy budou dynamicky přidávány zde -->
+            </div>
+            <div class="chat-input">
+                <input type="text" id="user-input" placeholder="Napište svou zprávu...">
+                <button id="send-button">Odeslat</button>
+                <button id="voice-button">Nahrát hlas</button>
+            </div>
+        </div>
+    </div>
+    <script src="{{ script_url }}"></script>
 </body>
 </html>
 """
 
+# Nastavení frontendu
+GOOGLE_FONTS = os.environ.get('BATA_GOOGLE_FONTS', '1') == '1'  # Kiosky bez přístupu k internetu mohou vypnout
+STATIC_MAX_AGE = 365 * 24 * 3600  # Otisk v názvu mění adresu při každé změně obsahu
+
+# Statický soubor předem zkomprimovaný pro všechna podporovaná kódování.
+# Otisk obsahu slouží jako ETag i jako součást adresy souboru.
+class StaticAsset:
+    def __init__(self, name, content, mimetype, immutable=True):
+        data = content.encode('utf-8')
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        stem, extension = os.path.splitext(name)
+        self.filename = f"{stem}.{self.digest[:10]}{extension}"
+        self.mimetype = mimetype
+        self.cache_control = f"public, max-age={STATIC_MAX_AGE}, immutable" if immutable else "no-cache"
+        self.variants = {'identity': data}
+        compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['br'] = brotli.compress(data, quality=11)
+        for encoding, body in compressed.items():
+            if len(body) < len(data):
+                self.variants[encoding] = body
+
+    def negotiate(self, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding] > 0:
+                return encoding
+        return 'identity'
+
+    def response(self):
+        encoding = self.negotiate(request.accept_encodings)
+        etag = self.digest if encoding == 'identity' else f"{self.digest}-{encoding}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], mimetype=self.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+# Stránka, styly a skript se sestaví jednou při prvním požadavku (nebo při
+# předehřátí) a dál se posílají jen hotové bajty
+frontend_assets = None
+frontend_lock = threading.Lock()
+
+def get_frontend_assets():
+    global frontend_assets
+    if frontend_assets is None:
+        with frontend_lock:
+            if frontend_assets is None:
+                style = StaticAsset('app.css', style_source, 'text/css')
+                script = StaticAsset('app.js', script_source, 'text/javascript')
+                page = app.jinja_env.from_string(html_template).render(
+                    style_url=f"/assets/{style.filename}",
+                    script_url=f"/assets/{script.filename}",
+                    google_fonts=GOOGLE_FONTS,
+                    voice_streaming=Sock is not None,
+                )
+                frontend_assets = {
+                    'page': StaticAsset('index.html', page, 'text/html', immutable=False),
+                    'files': {style.filename: style, script.filename: script},
+                }
+    return frontend_assets
+
 @app.route('/')
 def home():
-    return render_template_string(html_template)
+    return get_frontend_assets()['page'].response()
+
+@app.route('/assets/<filename>')
+def static_asset(filename):
+    asset = get_frontend_assets()['files'].get(filename)
+    if asset is None:
+        return jsonify({'error': 'Soubor nebyl nalezen'}), 404
+    return asset.response()
+
+# Předehřátí: načte vektorizér a vytvoří klienty na pozadí, aby je první
+# požadavek nemusel čekat (volitelně, BATA_WARMUP=1)
+def warm_up():
+    try:
+        embed_text("")
+        for name in client_factories:
+            get_client(name)
+        prerender_intent_audio()
+        get_frontend_assets()
+    except Exception as e:
+        print(f"Chyba při předehřátí: {str(e)}")
+
+if os.environ.get('BATA_WARMUP') == '1':
+    threading.Thread(target=warm_up, name='bata-warmup', daemon=True).start()
+
+# Nastavení produkčního serveru (gunicorn, více pracovních procesů s vlákny)
+SERVER_HOST = os.environ.get('BATA_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('BATA_PORT', 5000))
+SERVER_WORKERS = int(os.environ.get('BATA_WORKERS', os.cpu_count() or 1))
+SERVER_THREADS = int(os.environ.get('BATA_THREADS', 8))
+
+# Výchozí soubor sdíleného stavu v dočasném adresáři, vlastní pro každé nasazení
+# (umístění aplikace a port), aby dvě instance na jednom stroji nesdílely sezení
+def default_state_path(port=SERVER_PORT):
+    import tempfile
+    deployment = f"{os.path.abspath(__file__)}:{port}"
+    suffix = hashlib.sha256(deployment.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"bata_state_{suffix}.db")
+
+# Produkční spuštění. Každý pracovní proces si modul načte sám (bez preload),
+# takže vlákna a spojení vznikají až v něm. Klíč sezení a sdílené úložiště se
+# nastaví v proměnných prostředí, které procesy zdědí.
+def serve():
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("Chyba: produkční režim vyžaduje balíček gunicorn (pip install gunicorn)")
+        raise SystemExit(1)
+    import importlib
+    import secrets
+
+    if not os.environ.get('BATA_SECRET_KEY'):
+        os.environ['BATA_SECRET_KEY'] = secrets.token_hex(32)
+    if SERVER_WORKERS > 1 and not STATE_BACKEND_URL:
+        os.environ['BATA_STATE_BACKEND'] = 'sqlite:///' + default_state_path()
+        print(f"Sdílený stav: {os.environ['BATA_STATE_BACKEND']}")
+
+    class ChatbotApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{SERVER_HOST}:{SERVER_PORT}")
+            self.cfg.set('workers', SERVER_WORKERS)
+            self.cfg.set('threads', SERVER_THREADS)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', 120)  # Streamované odpovědi a nahrávky mohou trvat déle
+
+        def load(self):
+            return importlib.import_module('chatbot').app
+
+    ChatbotApplication().run()
 
 if __name__ == '__main__':
     print("Spouštění aplikace...")
-    app.run(debug=True)
\ No newline at end of file
+    if os.environ.get('BATA_PRODUCTION') == '1':
+        serve()
+    else:
+        app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,35 @@
+# Testy běží bez přihlašovacích údajů: klienti externích služeb se vytvářejí až
+# při prvním použití a v testech je nahrazují náhrady z benchmarks.fakes.
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatbot
+from benchmarks import fakes
+
+@pytest.fixture
+def fake_upstream():
+    clients, async_clients = dict(chatbot.clients), dict(chatbot.async_clients)
+    fakes.install(chatbot, fakes.default_profiles(llm=0.2, stt=0.01, tts=0.01, translate=0.0, jitter=0.0))
+    yield chatbot
+    chatbot.clients.clear()
+    chatbot.clients.update(clients)
+    chatbot.async_clients.clear()
+    chatbot.async_clients.update(async_clients)
+
+# Dotazy, které skutečně odešly na model (po sloučení a mimo mezipaměť)
+@pytest.fixture
+def model_calls(fake_upstream, monkeypatch):
+    calls = []
+    complete = chatbot.complete_bata_request
+
+    def counting(chat_request, language):
+        calls.append(chat_request)
+        return complete(chat_request, language)
+
+    monkeypatch.setattr(chatbot, 'complete_bata_request', counting)
+    return calls
@@ -0,0 +1,144 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+import chatbot
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('podmínka nebyla splněna včas')
+        time.sleep(0.005)
+
+def make_service(limit=1, queue_size=8, failure_threshold=1, reset_timeout=0.05):
+    service = chatbot.UpstreamService('openai', timeout=1.0, retries=0)
+    service.admission = chatbot.AdmissionController('test', limit, queue_size)
+    service.breaker = chatbot.CircuitBreaker(failure_threshold, reset_timeout)
+    return service
+
+def open_breaker(service):
+    service.breaker.record_failure()
+    time.sleep(service.breaker.reset_timeout * 2)
+
+def ok(timeout=None):
+    return 'ok'
+
+# Uvolněné místo dostane nejnižší priorita, v rámci priority se sezení střídají
+def test_admission_orders_waiters_by_priority_and_rotates_sessions():
+    admission = chatbot.AdmissionController('test', 1, queue_size=8)
+    admission.acquire(0, 'holder', time.monotonic() + 5)
+    order = []
+
+    def waiter(label, priority, session_id):
+        admission.acquire(priority, session_id, time.monotonic() + 5)
+        order.append(label)
+        admission.release(0.01)
+
+    waiters = [('voice', 2, 'C'), ('A1', 0, 'A'), ('A2', 0, 'A'), ('B1', 0, 'B'), ('A3', 0, 'A')]
+    threads = []
+    for label, priority, session_id in waiters:
+        thread = threading.Thread(target=waiter, args=(label, priority, session_id))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: admission.waiting == len(threads))
+    admission.release(0.01)
+    for thread in threads:
+        thread.join(2)
+
+    assert order == ['A1', 'B1', 'A2', 'A3', 'voice']
+    assert admission.stats()['active'] == 0
+
+def test_admission_rejects_when_deadline_cannot_be_met():
+    admission = chatbot.AdmissionController('test', 1, queue_size=8)
+    admission.acquire(0, 'holder', time.monotonic() + 5)
+    assert admission.rejection(0, time.monotonic() + 0.01) is not None
+    with pytest.raises(chatbot.OverloadedError) as error:
+        admission.acquire(0, 'late', time.monotonic() + 0.01)
+    assert error.value.retry_after > 0
+    assert admission.stats()['waiting'] == 0
+
+# Odmítnutí z fronty během polootevřeného stavu nesmí zablokovat zkušební volání
+def test_admission_rejection_does_not_wedge_half_open_probe():
+    service = make_service(queue_size=0)
+    open_breaker(service)
+    service.admission.acquire(0, 'holder', time.monotonic() + 5)
+    with pytest.raises(chatbot.OverloadedError):
+        service.call(ok)
+    assert not service.breaker.probing
+    service.admission.release()
+    assert service.call(ok) == 'ok'
+    assert service.breaker.state == 'closed'
+
+def test_cancelled_async_probe_releases_breaker_and_slot():
+    service = make_service()
+    open_breaker(service)
+
+    async def slow(timeout=None):
+        await asyncio.sleep(5)
+
+    async def scenario():
+        task = asyncio.ensure_future(service.call_async(slow))
+        await asyncio.sleep(0.05)
+        assert service.breaker.probing
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert not service.breaker.probing
+    assert service.admission.stats()['active'] == 0
+
+def test_stream_holds_slot_until_closed():
+    service = make_service(limit=2)
+    stream = service.stream(lambda timeout=None: iter(['a', 'b']))
+    assert next(stream) == 'a'
+    assert service.admission.active == 1
+    stream.close()
+    assert service.admission.active == 0
+
+# Každé selhání streamu se v jističi počítá jednou, při navázání i při čtení
+def test_stream_records_each_failure_once():
+    import requests
+    service = make_service(failure_threshold=5)
+
+    def refused(timeout=None):
+        raise requests.exceptions.ConnectionError('spojení odmítnuto')
+
+    def broken(timeout=None):
+        yield 'a'
+        raise requests.exceptions.ConnectionError('spojení přerušeno')
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        list(service.stream(refused))
+    assert service.breaker.failures == 1
+    with pytest.raises(requests.exceptions.ConnectionError):
+        list(service.stream(broken))
+    assert service.breaker.failures == 1  # Navázání uspělo a vynulovalo počítadlo
+    assert service.admission.active == 0
+
+# Termín fronty se počítá pro každé volání zvlášť, ne jednou za požadavek
+def test_queue_deadline_is_computed_per_call(monkeypatch):
+    monkeypatch.setattr(chatbot, 'ADMISSION_QUEUE_TIMEOUT', 0.05)
+    service = make_service()
+
+    def later_call():
+        chatbot.current_admission.set((1, 'session'))
+        time.sleep(0.1)  # Doba strávená u předchozích služeb
+        return service._admission_args()
+
+    priority, session_id, deadline = contextvars.copy_context().run(later_call)
+    assert (priority, session_id) == (1, 'session')
+    assert deadline > time.monotonic()
+
+# Přetížená syntéza po odpovědi modelu neshodí celý požadavek, odpověď přijde bez zvuku
+def test_text_chat_replies_without_audio_when_tts_is_overloaded(fake_upstream, monkeypatch):
+    monkeypatch.setattr(chatbot.tts_service, 'admission', chatbot.AdmissionController('tts', 0, queue_size=0))
+    response = chatbot.app.test_client().post('/text_chat', json={'text': f"Co je poctivá práce {time.time()}?"})
+
+    assert response.status_code == 200
+    assert response.json['response']
+    assert response.json['audio_url'] is None
@@ -0,0 +1,53 @@
+import os
+import threading
+
+import chatbot
+
+def test_analytics_shard_merge_adds_counters_topics_and_latency():
+    now = 1_000_000.0
+    first, second = chatbot.AnalyticsShard(), chatbot.AnalyticsShard()
+    for shard, words in ((first, ['zlín', 'boty']), (second, ['boty', 'práce'])):
+        shard.counters['total_conversations'] += 1
+        for word in words:
+            shard.add_topic(word)
+        shard.add_latency(0.5, now)
+
+    merged = chatbot.AnalyticsShard()
+    merged.merge(first)
+    merged.merge(chatbot.AnalyticsShard.from_bytes(second.to_bytes()))
+
+    assert merged.counters['total_conversations'] == 2
+    assert set(merged.candidates) == {'zlín', 'boty', 'práce'}
+    assert merged.topic_estimate('boty') == 2
+    assert int(merged.latency.sum()) == 2
+
+def test_analytics_shard_merge_prunes_candidates():
+    merged, other = chatbot.AnalyticsShard(), chatbot.AnalyticsShard()
+    for _ in range(3):
+        other.add_topic('častý')
+    other.add_topic('vzácný')
+    merged.merge(other, max_candidates=1)
+    assert list(merged.candidates) == ['častý']
+
+def test_analytics_threads_spread_across_shards():
+    engine = chatbot.AnalyticsEngine(shards=16)
+    used = set()
+    lock = threading.Lock()
+
+    def record():
+        shard = engine._shard()
+        with lock:
+            used.add(id(shard))
+
+    threads = [threading.Thread(target=record) for _ in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(used) == 16
+
+# Výchozí sdílený stav produkčního spuštění je pro každé nasazení vlastní
+def test_default_state_path_is_per_deployment():
+    assert chatbot.default_state_path(5000) == chatbot.default_state_path(5000)
+    assert chatbot.default_state_path(5000) != chatbot.default_state_path(5001)
+    assert os.path.basename(chatbot.default_state_path(5000)) != 'bata_state.db'
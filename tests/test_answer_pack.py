@@ -0,0 +1,29 @@
+import uuid
+
+import chatbot
+
+class FailingTranslateClient:
+    def translate(self, values, target_language=None, **kwargs):
+        raise ValueError('překlad není k dispozici')
+
+# Položka s nezdařeným překladem se do balíčku nedostane, česká ano
+def test_build_skips_entries_whose_translation_fails(fake_upstream, tmp_path):
+    chatbot.clients['translate'] = FailingTranslateClient()
+    question = f"Proč stavět domy pro zaměstnance {uuid.uuid4().hex[:6]}?"
+    path = str(tmp_path / 'answers.pack')
+
+    version, count = chatbot.build_answer_pack(path, [question, ('Why build houses?', 'en')], languages=('cs', 'de'))
+
+    entries = chatbot.AnswerPack(path).entries
+    assert count == 1
+    assert [(entry['question'], entry['language']) for entry in entries] == [(question, 'cs')]
+
+def test_build_translates_question_and_answer(fake_upstream, tmp_path):
+    question = f"Co je poctivá práce {uuid.uuid4().hex[:6]}?"
+    path = str(tmp_path / 'answers.pack')
+
+    chatbot.build_answer_pack(path, [question], languages=('de',))
+
+    entry, = chatbot.AnswerPack(path).entries
+    assert entry['question'] == f"[de] {question}"
+    assert entry['answer'].startswith('[de] ')
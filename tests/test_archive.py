@@ -0,0 +1,68 @@
+import threading
+import uuid
+
+import chatbot
+
+def test_archive_append_search_and_reopen(tmp_path):
+    directory = str(tmp_path / 'archive')
+    archive = chatbot.ConversationArchive(directory)
+    for index in range(chatbot.ARCHIVE_INITIAL_ROWS + 10):  # Vynutí zvětšení souborů
+        archive.append(f"Otázka číslo {index}", f"Odpověď {index}", 'cs')
+    archive.append('Jak vznikla firma Baťa?', 'Ve Zlíně roku 1894.', 'cs')
+
+    reader = chatbot.ConversationArchive(directory, readonly=True)
+    assert len(reader) == chatbot.ARCHIVE_INITIAL_ROWS + 11
+    assert reader.search('Jak vznikla firma Baťa?', k=1)[0]['answer'] == 'Ve Zlíně roku 1894.'
+
+def test_archive_compaction_keeps_latest_answer(tmp_path):
+    archive = chatbot.ConversationArchive(str(tmp_path / 'archive'))
+    archive.append('Co je práce?', 'stará odpověď', 'cs')
+    archive.append('Co je práce?', 'nová odpověď', 'cs')
+    archive.append('Co je práce?', 'Arbeit', 'de')
+    reader = chatbot.ConversationArchive(archive.directory, readonly=True)
+
+    result = archive.compact()
+
+    assert (result['before'], result['after']) == (3, 2)
+    assert sorted(record['answer'] for record in reader) == ['Arbeit', 'nová odpověď']
+
+def test_archive_concurrent_writers(tmp_path):
+    directory = str(tmp_path / 'archive')
+    writers = [chatbot.ConversationArchive(directory) for _ in range(4)]
+
+    def write(archive, writer):
+        for index in range(50):
+            archive.append(f"Otázka {writer}-{index}", 'odpověď', 'cs')
+
+    threads = [threading.Thread(target=write, args=(archive, writer)) for writer, archive in enumerate(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    questions = [record['question'] for record in chatbot.ConversationArchive(directory, readonly=True)]
+    assert len(questions) == len(set(questions)) == 200
+
+def test_relevant_context_ignores_archive_by_default(tmp_path, monkeypatch):
+    archive = chatbot.ConversationArchive(str(tmp_path / 'archive'))
+    archive.append('Jaké je moje heslo?', 'Vaše heslo je tajné123.', 'cs')
+    monkeypatch.setattr(chatbot, 'archive', archive)
+
+    assert chatbot.get_relevant_context('Jaké je moje heslo?', f"test-{uuid.uuid4().hex}") == []
+    monkeypatch.setattr(chatbot, 'ARCHIVE_CONTEXT', True)
+    assert chatbot.get_relevant_context('Jaké je moje heslo?', f"test-{uuid.uuid4().hex}")
+
+# Kompaktace je správcovská operace: bez tokenu je vypnutá, vstup se kontroluje
+def test_archive_compaction_requires_admin_token_and_valid_age(tmp_path, monkeypatch):
+    monkeypatch.setattr(chatbot, 'archive', chatbot.ConversationArchive(str(tmp_path / 'archive')))
+    client = chatbot.app.test_client()
+    admin = {'X-Admin-Token': 'tajne'}
+
+    assert client.post('/archive/compact', json={}, headers=admin).status_code == 403
+    monkeypatch.setattr(chatbot, 'ADMIN_TOKEN', 'tajne')
+    assert client.post('/archive/compact', json={}).status_code == 403
+    assert client.post('/archive/compact', json={}, headers={'X-Admin-Token': 'jine'}).status_code == 403
+    for max_age_days in (0, -1, 'x', True, [1]):
+        assert client.post('/archive/compact', json={'max_age_days': max_age_days}, headers=admin).status_code == 400
+    assert client.post('/archive/compact', json={'max_age_days': 30}, headers=admin).status_code == 202
+    assert client.post('/archive/compact', headers={'Authorization': 'Bearer tajne'}).status_code == 202
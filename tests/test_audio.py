@@ -0,0 +1,17 @@
+import chatbot
+
+def test_audio_route_rejects_invalid_ids():
+    client = chatbot.app.test_client()
+    for audio_id in ('..', '...', '..x', 'A' * 64, 'a' * 63):
+        assert client.get(f'/audio/{audio_id}.mp3').status_code == 404
+
+# Přípona v adrese musí odpovídat skutečnému formátu zvuku, jinak by se MP3
+# poslalo jako audio/ogg s trvalým ukládáním v prohlížeči
+def test_audio_route_checks_extension_against_format(fake_upstream):
+    client = chatbot.app.test_client()
+    for audio_format, other in (('mp3', 'ogg'), ('ogg', 'mp3')):
+        url = chatbot.text_to_speech_url(f"Zkouška formátu {audio_format}", 'cs', 'default', 1.0, audio_format)
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.mimetype == chatbot.AUDIO_FORMATS[audio_format]['mimetype']
+        assert client.get(url.rsplit('.', 1)[0] + '.' + other).status_code == 404
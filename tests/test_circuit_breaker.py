@@ -0,0 +1,35 @@
+import time
+
+import pytest
+
+import chatbot
+
+def make_service(failure_threshold=2, reset_timeout=0.05):
+    service = chatbot.UpstreamService('openai', timeout=1.0, retries=0)
+    service.breaker = chatbot.CircuitBreaker(failure_threshold, reset_timeout)
+    return service
+
+def test_breaker_opens_after_threshold_and_rejects_calls():
+    breaker = chatbot.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+# Po uplynutí reset_timeout projde jediné zkušební volání, úspěch jistič zavře
+def test_breaker_allows_one_probe_and_closes_after_success():
+    service = make_service(failure_threshold=1)
+    service.breaker.record_failure()
+    time.sleep(0.1)
+    assert service.breaker.allow()
+    assert not service.breaker.allow()
+    service.breaker.record_success()
+    assert service.call(lambda timeout=None: 'ok') == 'ok'
+    assert service.breaker.state == 'closed'
+
+def test_open_breaker_fails_fast():
+    service = make_service(failure_threshold=1, reset_timeout=60)
+    service.breaker.record_failure()
+    with pytest.raises(chatbot.CircuitOpenError):
+        service.call(lambda timeout=None: 'ok')
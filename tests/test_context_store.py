@@ -0,0 +1,17 @@
+import chatbot
+
+# Úložiště o velikosti paměti sezení se natrénuje a dál najde uložené otázky
+def test_ivf_store_trains_at_session_memory_size():
+    store = chatbot.IVFContextStore(chatbot.SESSION_MEMORY_SIZE)
+    assert store.train_size <= chatbot.SESSION_MEMORY_SIZE
+    for index in range(store.train_size):
+        store.add(f"Otázka číslo {index} o obuvi a práci", f"Odpověď {index}")
+
+    assert store.centroids is not None
+    assert store.search('Otázka číslo 42 o obuvi a práci', k=1, threshold=0.99) == [('Otázka číslo 42 o obuvi a práci', 'Odpověď 42')]
+
+def test_ivf_store_scales_lists_to_capacity():
+    small, large = chatbot.IVFContextStore(10), chatbot.IVFContextStore(20000)
+    assert small.n_lists <= small.train_size <= small.capacity
+    assert small.n_probe <= small.n_lists
+    assert (large.n_lists, large.train_size) == (128, 4096)
@@ -0,0 +1,59 @@
+import io
+import threading
+
+import pytest
+
+import chatbot
+
+def test_aho_corasick_finds_overlapping_patterns():
+    automaton = chatbot.AhoCorasick([('he', 1), ('she', 2), ('hers', 3), ('his', 4)])
+    assert sorted(automaton.search('ushers')) == [1, 2, 3]
+    assert list(automaton.search('xyz')) == []
+
+def test_fold_text_strips_case_diacritics_and_punctuation():
+    assert chatbot.fold_text('  Smaž HISTORII, prosím!') == 'smaz historii prosim'
+
+def test_router_matches_commands_inside_sentence_and_faqs_exactly():
+    router = chatbot.intent_router
+    assert router.match('Prosím smaž historii a začneme znovu', 'cs', kinds=('command',)).name == 'clear_history'
+    assert router.match('Jaká je vaše filozofie podnikání?', 'cs').name == 'philosophy'
+    assert router.match('Jaká je vaše filozofie podnikání v roce 1920?', 'cs') is None
+
+def test_router_falls_back_to_czech_phrases():
+    assert chatbot.intent_router.match('smaž historii', 'en', kinds=('command',)).name == 'clear_history'
+
+def test_benchmark_transcript_is_not_an_intent():
+    from benchmarks import fakes
+    transcript = fakes.FakeSpeechClient(None).transcript
+    assert chatbot.intent_router.match(transcript, 'cs') is None
+
+def test_hit_counters_are_thread_safe():
+    router = chatbot.IntentRouter(chatbot.intent_router.intents)
+    intent = router.intents[0]
+
+    def hit():
+        for _ in range(1000):
+            router.record_hit(intent)
+
+    threads = [threading.Thread(target=hit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert router.stats()[intent.name] == 8000
+
+# Hlasový záměr vrací stejné klíče jako běžná hlasová odpověď, které čte frontend
+@pytest.mark.parametrize('view', ['voice_chat', 'voice_chat_async'])
+def test_voice_intent_reply_uses_response_text_key(fake_upstream, monkeypatch, view):
+    question = 'Jaká je vaše filozofie podnikání?'
+    chatbot.clients['speech'].transcript = question
+    chatbot.async_clients['speech'].transcript = question
+    monkeypatch.setitem(chatbot.app.view_functions, 'voice_chat', getattr(chatbot, view))
+
+    response = chatbot.app.test_client().post('/voice_chat', data={'file': (io.BytesIO(b'\0' * 320), 'audio.wav')})
+
+    assert response.status_code == 200
+    assert set(response.json) == {'response_text', 'recognized_text', 'audio_url', 'audio_duration'}
+    assert response.json['recognized_text'] == question
+    assert response.json['response_text'] == chatbot.intent_router.match(question, 'cs').response('cs')
+    assert response.json['audio_url']
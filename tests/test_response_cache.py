@@ -0,0 +1,55 @@
+import uuid
+
+import chatbot
+
+def new_session():
+    return f"test-{uuid.uuid4().hex}"
+
+# Odpověď postavená na historii sezení se do mezipaměti neukládá a sezení
+# s historií mezipaměť nepoužívá
+def test_response_cache_keeps_session_answers_private(model_calls):
+    question = f"Co si pamatujete o mém projektu {uuid.uuid4().hex[:6]}?"
+    private = new_session()
+    chatbot.update_context('Můj projekt je tajný.', 'Rozumím.', private)
+
+    chatbot.generate_bata_response(question, 'cs', private)
+    chatbot.generate_bata_response(question, 'cs', new_session())
+    assert len(model_calls) == 2
+
+    chatbot.generate_bata_response(question, 'cs', new_session())
+    assert len(model_calls) == 2  # Obecná odpověď druhého sezení už je v mezipaměti
+
+    chatbot.generate_bata_response(question, 'cs', private)
+    assert len(model_calls) == 3
+
+def test_invalidation_requires_admin_token(monkeypatch):
+    client = chatbot.app.test_client()
+    assert client.post('/response_cache/invalidate', json={}).status_code == 403
+    monkeypatch.setattr(chatbot, 'ADMIN_TOKEN', 'tajne')
+    assert client.post('/response_cache/invalidate', json={}, headers={'X-Admin-Token': 'jine'}).status_code == 403
+    assert client.post('/response_cache/invalidate', json={}, headers={'X-Admin-Token': 'tajne'}).status_code == 200
+
+# Zneplatnění v jednom pracovním procesu se přes sdílené úložiště projeví i v ostatních
+def test_invalidation_is_broadcast_through_state_backend():
+    backend = chatbot.MemoryStateBackend()
+    first, second = (chatbot.ResponseCache(threshold=0.9, backend=backend, sync_interval=0) for _ in range(2))
+    for cache in (first, second):
+        cache.set('Kde sídlila firma Baťa?', 'cs', 've Zlíně')
+        cache.set('Co je práce?', 'cs', 'služba')
+
+    first.invalidate('cs', 'Kde sídlila firma Baťa?')
+
+    assert second.get('Kde sídlila firma Baťa?', 'cs') is None
+    assert second.get('Co je práce?', 'cs') == 'služba'
+
+def test_missed_invalidations_clear_whole_cache(monkeypatch):
+    monkeypatch.setattr(chatbot, 'RESPONSE_CACHE_INVALIDATIONS', 2)
+    backend = chatbot.MemoryStateBackend()
+    first = chatbot.ResponseCache(backend=backend, sync_interval=0)
+    second = chatbot.ResponseCache(backend=backend, sync_interval=3600)
+    second.set('Co je práce?', 'cs', 'služba')
+    for language in ('de', 'en', 'fr'):
+        first.invalidate(language)
+
+    second.sync_interval = 0
+    assert second.get('Co je práce?', 'cs') is None
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+
+import chatbot
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('podmínka nebyla splněna včas')
+        time.sleep(0.005)
+
+def ask_concurrently(question, session_ids):
+    threads = [threading.Thread(target=chatbot.generate_bata_response, args=(question, 'cs', session_id))
+               for session_id in session_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+def test_singleflight_coalesces_concurrent_calls():
+    flight = chatbot.SingleFlight()
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'result'
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert 'key' not in flight.calls
+
+# Zrušený první volající uvolní klíč a čekatel volání provede sám
+def test_singleflight_releases_key_when_leader_is_cancelled():
+    flight = chatbot.SingleFlight()
+    results = []
+
+    async def slow():
+        await asyncio.sleep(5)
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do_async('key', slow))
+        await asyncio.sleep(0.02)
+        follower = threading.Thread(target=lambda: results.append(flight.do('key', lambda: 'own')))
+        follower.start()
+        wait_until(lambda: flight.coalesced == 1)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        await asyncio.to_thread(follower.join, 2)
+
+    asyncio.run(scenario())
+    assert results == [('own', False)]
+    assert 'key' not in flight.calls
+
+def test_singleflight_cancelled_follower_keeps_shared_call():
+    flight = chatbot.SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(5)
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do_async('key', lambda: asyncio.sleep(0.1, 'result')))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flight.do_async('key', slow))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(scenario()) == ('result', False)
+
+# Souběžné stejné otázky se sloučí jen u sezení, jejichž prompt je stejný
+def test_calls_are_not_shared_across_session_history(model_calls, monkeypatch):
+    monkeypatch.setattr(chatbot.response_cache, 'enabled', False)
+    private, other = f"test-{uuid.uuid4().hex}", f"test-{uuid.uuid4().hex}"
+    chatbot.update_context('Jmenuji se Jan Novák.', 'Těší mě.', private)
+
+    ask_concurrently('Co o mně víte?', [private, other])
+
+    assert len(model_calls) == 2
+    other_prompt = next(request for request in model_calls if len(request['messages']) == 2)
+    assert 'Jan Novák' not in str(other_prompt)
+
+def test_fresh_sessions_share_one_call(model_calls, monkeypatch):
+    monkeypatch.setattr(chatbot.response_cache, 'enabled', False)
+    ask_concurrently('Jaký je smysl práce?', [f"test-{uuid.uuid4().hex}" for _ in range(4)])
+    assert len(model_calls) == 1